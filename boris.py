@@ -40,6 +40,7 @@ import urllib.error
 import tempfile
 import glob
 import statistics
+import bisect
 import datetime
 import multiprocessing
 import socket
@@ -122,6 +123,15 @@ import plot_spectrogram
 import coding_pad
 import transitions
 import recode_widget
+import event_store
+import ethogram_index
+import time_budget
+import project_file
+import project_db
+import project_snapshot
+import frame_decoder
+import image_cache
+import clip_extraction
 
 from config import *
 
@@ -242,24 +252,98 @@ class ProjectServerThread(QThread):
 
 
 
+class AutosaveThread(QThread):
+    """
+    thread for writing a project snapshot (see MainWindow.project_writer)
+    """
+
+    signal = pyqtSignal(dict)
+
+    def __init__(self, fileName, write):
+        QThread.__init__(self)
+        self.fileName = fileName
+        self.write = write
+
+    def __del__(self):
+        self.wait()
+
+    def run(self):
+        try:
+            self.write()
+            self.signal.emit({"saved": self.fileName})
+        except:
+            logging.critical("The project file can not be saved.\nError: {}".format(sys.exc_info()[1]))
+            self.signal.emit({"error": str(sys.exc_info()[1])})
+        self.write = None
+
+
+class AnalysisThread(QThread):
+    """
+    thread running an analysis of a project snapshot (see MainWindow.run_analysis)
+    """
+
+    signal = pyqtSignal(dict)
+
+    def __init__(self, analysis):
+        QThread.__init__(self)
+        self.analysis = analysis
+
+    def __del__(self):
+        self.wait()
+
+    def run(self):
+        try:
+            self.signal.emit({"result": self.analysis()})
+        except:
+            logging.critical("Error during analysis: {}".format(sys.exc_info()[1]))
+            self.signal.emit({"error": str(sys.exc_info()[1])})
+        self.analysis = None
+
+
+class ClipExtractionThread(QThread):
+    """
+    thread extracting the sequences of events (see MainWindow.extract_events)
+    """
+
+    signal = pyqtSignal(dict)
+
+    def __init__(self, extractor):
+        QThread.__init__(self)
+        self.extractor = extractor
+
+    def __del__(self):
+        self.wait()
+
+    def run(self):
+        errors = self.extractor.run(lambda done, total: self.signal.emit({"progress": done}))
+        self.signal.emit({"errors": errors})
+
+
 class TempDirCleanerThread(QThread):
     """
     class for cleaning image cache directory with qthread
+    the least recently used frames are deleted when the directory exceeds its maximum size
+    (see image_cache.ImageCacheIndex.evict)
     """
     def __init__(self, parent = None):
         QThread.__init__(self, parent)
         self.exiting = False
         self.tempdir = ""
+        self.index = None  # index of extracted frames (image_cache.ImageCacheIndex)
         self.ffmpeg_cache_dir_max_size = 0
 
     def run(self):
+        lastStats = None
         while self.exiting == False:
-            if sum(os.path.getsize(self.tempdir + f) for f in os.listdir(self.tempdir) if "BORIS@" in f and os.path.isfile(self.tempdir + f)) > self.ffmpeg_cache_dir_max_size:
-                fl = sorted((os.path.getctime(self.tempdir + f), self.tempdir + f) for f in os.listdir(self.tempdir) if "BORIS@" in f and os.path.isfile(self.tempdir + f))
-                for ts, f in fl[0:int(len(fl) / 10)]:
-                    os.remove(f)
-            time.sleep(30)
-            logging.debug("cleaning frame cache directory")
+            # sizes are read from the index: the directory is not listed
+            self.index.evict(self.ffmpeg_cache_dir_max_size)
+            # the index is saved and the counters logged only if the cache was used
+            stats = self.index.stats()
+            if stats != lastStats:
+                self.index.save()
+                logging.debug("frame cache: {}".format(stats))
+                lastStats = stats
+            time.sleep(image_cache.CLEANING_INTERVAL)
 
 ROW = -1 # red triangle
 
@@ -292,6 +376,91 @@ class StyledItemDelegateTriangle(QStyledItemDelegate):
                 painter.restore()
 
 
+class EventsTableModel(QAbstractTableModel, event_store.EventStoreListener):
+    """
+    model of events table (twEvents) over the event store of the current observation
+    only the visible rows are rendered by the view
+    """
+
+    def __init__(self, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.events = event_store.EventStore()
+        self.stateBehaviorsCodes = set()
+        self.convertTime = str
+
+    def set_events(self, events, stateBehaviorsCodes=(), convertTime=str):
+        """
+        show events of an event store (empty table if events is None)
+        """
+        self.beginResetModel()
+        self.events.remove_listener(self)
+        self.events = events if events is not None else event_store.EventStore()
+        self.events.add_listener(self)
+        self.stateBehaviorsCodes = set(stateBehaviorsCodes)
+        self.convertTime = convertTime
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.events)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(tw_events_fields)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return tw_events_fields[section]
+        return str(section + 1)
+
+    def status(self, row):
+        """
+        START/STOP status of state event at row ("" for point events)
+        """
+        time, subject, code, modifier = self.events[row][:EVENT_COMMENT_FIELD_IDX]
+        if code not in self.stateBehaviorsCodes:
+            return ""
+        return STOP if self.events.count_before(subject, code, time, modifier=modifier, strict=True) % 2 else START
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        field_type = tw_events_fields[index.column()]
+        if field_type == TYPE:
+            return self.status(index.row())
+        field = self.events[index.row()][pj_obs_fields[field_type]]
+        if field_type == "time":
+            return str(self.convertTime(field))
+        return field
+
+    def status_changed(self, row, event):
+        """
+        status of following events with same behavior can change
+        """
+        if event[EVENT_BEHAVIOR_FIELD_IDX] in self.stateBehaviorsCodes and row < len(self.events):
+            self.dataChanged.emit(self.index(row, tw_obs_fields[TYPE]), self.index(len(self.events) - 1, tw_obs_fields[TYPE]))
+
+    def event_about_to_be_inserted(self, row, event):
+        self.beginInsertRows(QModelIndex(), row, row)
+
+    def event_inserted(self, row, event):
+        self.endInsertRows()
+        self.status_changed(row + 1, event)
+
+    def event_about_to_be_removed(self, row, event):
+        self.beginRemoveRows(QModelIndex(), row, row)
+
+    def event_removed(self, row, event):
+        self.endRemoveRows()
+        self.status_changed(row, event)
+
+    def events_about_to_be_reset(self):
+        self.beginResetModel()
+
+    def events_reset(self):
+        self.endResetModel()
+
+
 class MainWindow(QMainWindow, Ui_MainWindow):
 
     pj = {"time_format": HHMMSS,
@@ -327,6 +496,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     automaticBackup = 0                # automatic backup interval (0 no backup)
 
     projectChanged = False
+    autosaveThread = None
+    autosaveJournalPosition = None  # size of events journal at automatic backup snapshot
+    journal = None                  # journal of events modifications of the project file
+    projectCompression = None       # compression of project file (project_file.GZIP, project_file.ZSTD or None)
+    projectStorage = None           # project_db.SQLITE for project database or None for JSON file
 
     liveObservationStarted = False
 
@@ -354,6 +528,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     fast = 10
 
     currentStates = {}
+    stateTracker = None   # incremental current states of the current observation
+    ethogramIndex = None  # lookup tables of the ethogram
     flag_slow = False
     play_rate = 1
 
@@ -396,6 +572,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     tcp_port = 0
 
     cleaningThread = TempDirCleanerThread()
+    clipExtractionThread = None  # extraction of sequences of events
+    imageCacheIndex = None  # index of frames extracted in frame cache directory (image_cache.ImageCacheIndex)
 
 
     def __init__(self, availablePlayers, ffmpeg_bin, parent = None):
@@ -500,10 +678,10 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # set painter for twEvents to highlight current row
         self.twEvents.setItemDelegate(StyledItemDelegateTriangle(self.twEvents))
 
-        self.twEvents.setColumnCount( len(tw_events_fields) )
-        self.twEvents.setHorizontalHeaderLabels(tw_events_fields)
+        # events table model (events of current observation)
+        self.eventsModel = EventsTableModel(self)
+        self.twEvents.setModel(self.eventsModel)
 
-        self.imagesList = set()
         self.FFmpegGlobalFrame = 0
 
         self.menu_options()
@@ -793,7 +971,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.actionFrame_forward.triggered.connect(self.frame_forward)
 
         # table Widget double click
-        self.twEvents.itemDoubleClicked.connect(self.twEvents_doubleClicked)
+        self.twEvents.doubleClicked.connect(self.twEvents_doubleClicked)
         self.twEthogram.itemDoubleClicked.connect(self.twEthogram_doubleClicked)
         self.twSubjects.itemDoubleClicked.connect(self.twSubjects_doubleClicked)
 
@@ -865,6 +1043,18 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.readConfigFile()
 
         # timer for automatic backup
+        self.projectSerializer = project_file.ProjectSerializer()
+        self.projectDbWriter = project_db.ProjectDbWriter()
+
+        # ffmpeg processes decoding frames in frame-by-frame mode {media file: MediaFrames}
+        self.frameDecoders = {}
+        # decoded frames kept in memory
+        self.frameCache = frame_decoder.FrameCache(max_size=frame_decoder.cache_size(self.ffmpeg_cache_dir_max_size))
+
+        # analyses running in threads
+        self.projectSnapshots = project_snapshot.ProjectSnapshots()
+        self.analysisThreads = []
+
         self.automaticBackupTimer = QTimer(self)
         self.automaticBackupTimer.timeout.connect(self.automatic_backup)
         if self.automaticBackup:
@@ -1243,7 +1433,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         """
         extract sequences from media file corresponding to coded events
         in case of point event, from -n to +n seconds are extracted (n = self.repositioningTimeOffset)
+        the sequences are extracted in a thread by a pool of ffmpeg processes (see clip_extraction)
         """
+        if self.clipExtractionThread is not None and self.clipExtractionThread.isRunning():
+            QMessageBox.warning(self, programName, "The extraction of sequences is already running")
+            return
+
         result, selectedObservations = self.selectObservations(MULTIPLE)
 
         if not selectedObservations:
@@ -1268,10 +1463,20 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             QMessageBox.warning(self, programName, "<b>{}</b> is not recognized as time offset".format(text))
             return
 
+        stream_copy = dialog.MessageDialog(programName, ("Extraction mode:<br><br><b>Stream copy</b> is fast but the sequences start on the "
+                                                         "key frame preceding the start time.<br><b>Re-encode</b> is slower but accurate"),
+                                           ["Stream copy", "Re-encode", CANCEL])
+        if stream_copy == CANCEL:
+            return
+        stream_copy = stream_copy == "Stream copy"
+
         flagUnpairedEventFound = False
+        # sequences with an empty or out of media interval
+        skippedSequences = 0
 
         cursor = self.loadEventsInDB(plot_parameters["selected subjects"], selectedObservations, plot_parameters["selected behaviors"])
 
+        commands = []
         for obsId in selectedObservations:
 
             for nplayer in [PLAYER1, PLAYER2]:
@@ -1279,97 +1484,112 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 if not self.pj[OBSERVATIONS][obsId][FILE][nplayer]:
                     continue
 
+                mediaFiles = self.pj[OBSERVATIONS][obsId][FILE][nplayer]
                 duration1 = []   # in seconds
-                for mediaFile in self.pj[OBSERVATIONS][obsId][FILE][nplayer]:
+                for mediaFile in mediaFiles:
                     duration1.append(self.pj[OBSERVATIONS][obsId]["media_info"]["length"][mediaFile])
 
+                # start time of each media file in observation
+                mediaStart = [sum(duration1[0:idx]) for idx in range(len(duration1))]
+
                 logging.debug("duration player {}: {}".format(nplayer, duration1))
 
                 for subject in plot_parameters["selected subjects"]:
 
                     for behavior in plot_parameters["selected behaviors"]:
 
-                        cursor.execute("SELECT occurence FROM events WHERE observation = ? AND subject = ? AND code = ?",
+                        cursor.execute("SELECT occurence FROM events WHERE observation = ? AND subject = ? AND code = ? ORDER BY occurence",
                                        (obsId, subject, behavior))
                         rows = [{"occurence":float2decimal(r["occurence"])}  for r in cursor.fetchall()]
 
-                        if STATE in self.eventType(behavior).upper() and len(rows) % 2:  # unpaired events
+                        behaviorType = self.eventType(behavior).upper()
+                        if STATE in behaviorType and len(rows) % 2:  # unpaired events
                             flagUnpairedEventFound = True
                             continue
 
                         for idx, row in enumerate(rows):
 
-                            mediaFileIdx = [idx1 for idx1, x in enumerate(duration1) if row["occurence"] >= sum(duration1[0:idx1])][-1]
+                            if STATE in behaviorType and idx % 2:
+                                continue
+
+                            mediaFileIdx = max(0, bisect.bisect_right(mediaStart, row["occurence"]) - 1)
 
                             globalStart = Decimal("0.000") if row["occurence"] < timeOffset else round(row["occurence"] - timeOffset, 3)
-                            start = round(row["occurence"] - timeOffset - sum(duration1[0:mediaFileIdx]), 3)
+                            start = round(row["occurence"] - timeOffset - mediaStart[mediaFileIdx], 3)
                             if start < timeOffset:
                                 start = Decimal("0.000")
 
-                            if POINT in self.eventType(behavior).upper():
-
-                                #globalStart = Decimal("0.000") if row["occurence"] < timeOffset else round(row["occurence"] - timeOffset, 3)
+                            if POINT in behaviorType:
                                 globalStop = round(row["occurence"] + timeOffset, 3)
+                                stop = round(row["occurence"] + timeOffset - mediaStart[mediaFileIdx], 3)
 
-                                #start = round(row["occurence"] - timeOffset - sum(duration1[0:mediaFileIdx]), 3)
-                                #if start < timeOffset:
-                                #    start = Decimal("0.000")
-                                stop = round(row["occurence"] + timeOffset - sum(duration1[0:mediaFileIdx]))
-
-                                ffmpeg_command = '"{ffmpeg_bin}" -i "{input}" -y -ss {start} -to {stop} "{dir}{sep}{obsId}_{player}_{subject}_{behavior}_{globalStart}-{globalStop}{extension}" '.format(
-                                        ffmpeg_bin=ffmpeg_bin,
-                                        input=self.pj[OBSERVATIONS][obsId][FILE][nplayer][mediaFileIdx],
-                                        start=start,
-                                        stop=stop,
-                                        globalStart=globalStart,
-                                        globalStop=globalStop,
-                                        dir=exportDir,
-                                        sep=os.sep,
-                                        obsId=obsId,
-                                        player="PLAYER{}".format(nplayer),
-                                        subject=subject,
-                                        behavior=behavior,
-                                        extension=os.path.splitext(self.pj[OBSERVATIONS][obsId][FILE][nplayer][mediaFileIdx])[-1])
-
-                                logging.debug("ffmpeg command: {}".format( ffmpeg_command ))
-                                p = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-                                out, error = p.communicate()
+                            if STATE in behaviorType:
+                                globalStop = round(rows[idx + 1]["occurence"] + timeOffset, 3)
+                                stop = round(rows[idx + 1]["occurence"] + timeOffset - mediaStart[mediaFileIdx], 3)
 
+                                # check if start after length of media
+                                if start > duration1[mediaFileIdx]:
+                                    logging.warning("start after end of media: {} {}".format(start, duration1[mediaFileIdx]))
+                                    skippedSequences += 1
+                                    continue
 
-                            if STATE in self.eventType(behavior).upper():
-                                if idx % 2 == 0:
+                            if stop <= start:
+                                logging.warning("empty sequence: {} {}".format(start, stop))
+                                skippedSequences += 1
+                                continue
+
+                            output = "{dir}{sep}{obsId}_{player}_{subject}_{behavior}_{globalStart}-{globalStop}{extension}".format(
+                                      dir=exportDir,
+                                      sep=os.sep,
+                                      obsId=obsId,
+                                      player="PLAYER{}".format(nplayer),
+                                      subject=subject,
+                                      behavior=behavior,
+                                      globalStart=globalStart,
+                                      globalStop=globalStop,
+                                      extension=os.path.splitext(mediaFiles[mediaFileIdx])[-1])
 
-                                    #globalStart = round(row["occurence"], 3)
-                                    globalStop = round(rows[idx + 1]["occurence"] + timeOffset, 3)
+                            commands.append(clip_extraction.clip_command(self.ffmpeg_bin, mediaFiles[mediaFileIdx], start, stop, output, stream_copy))
 
-                                    #start = round(row["occurence"] - sum( duration1[0:mediaFileIdx]), 3)
-                                    stop = round(rows[idx + 1]["occurence"] + timeOffset - sum( duration1[0:mediaFileIdx]))
+        warnings = []
+        if flagUnpairedEventFound:
+            warnings.append("Some state events are not paired. They were not extracted")
+        if skippedSequences:
+            warnings.append("{} sequence(s) with a stop time not after the start time or starting after the end of the media were not extracted".format(skippedSequences))
+        if warnings:
+            QMessageBox.warning(self, programName, "<br>".join(warnings))
+
+        if not commands:
+            self.statusbar.showMessage("No sequence to extract", 5000)
+            return
 
-                                    # check if start after length of media
-                                    if start >  self.pj[OBSERVATIONS][obsId]["media_info"]["length"][self.pj[OBSERVATIONS][obsId][FILE][nplayer][mediaFileIdx]]:
-                                        print("start after end", start, self.pj[OBSERVATIONS][obsId]["media_info"]["length"][self.pj[OBSERVATIONS][obsId][FILE][nplayer][mediaFileIdx]])
-                                        continue
+        # clips are extracted in a thread: coding can continue
+        self.clipExtractionThread = ClipExtractionThread(clip_extraction.ClipExtractor(commands))
+        self.clipExtractionProgress = QProgressDialog("Extracting {} sequences to {}".format(len(commands), exportDir), "Cancel", 0, len(commands), self)
+        self.clipExtractionProgress.setWindowTitle(programName)
+        self.clipExtractionProgress.setAutoClose(False)
+        self.clipExtractionProgress.canceled.connect(self.clipExtractionThread.extractor.cancel)
 
-                                    ffmpeg_command = '"{ffmpeg_bin}" -i "{input}" -y -ss {start} -to {stop} "{dir}{sep}{obsId}_{player}_{subject}_{behavior}_{globalStart}-{globalStop}{extension}" '.format(
-                                    ffmpeg_bin=ffmpeg_bin,
-                                    input=self.pj[OBSERVATIONS][obsId][FILE][nplayer][mediaFileIdx],
-                                    start=start,
-                                    stop=stop,
-                                    globalStart=globalStart,
-                                    globalStop=globalStop,
-                                    dir=exportDir,
-                                    sep=os.sep,
-                                    obsId=obsId,
-                                    player="PLAYER{}".format(nplayer),
-                                    subject=subject,
-                                    behavior=behavior,
-                                    extension=os.path.splitext(self.pj[OBSERVATIONS][obsId][FILE][nplayer][mediaFileIdx])[-1])
+        def extraction_progress(msg):
+            if "progress" in msg:
+                self.clipExtractionProgress.setValue(msg["progress"])
+                return
 
-                                    logging.debug("ffmpeg command: {}".format(ffmpeg_command))
-                                    p = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-                                    out, error = p.communicate()
+            # closing the progress dialog emits canceled
+            cancelled = self.clipExtractionThread.extractor.cancelled
+            self.clipExtractionProgress.canceled.disconnect()
+            self.clipExtractionProgress.close()
+            if cancelled:
+                self.statusbar.showMessage("Extraction of sequences cancelled", 0)
+            elif msg["errors"]:
+                QMessageBox.warning(self, programName, "{} sequences can not be extracted:<br>{}".format(len(msg["errors"]),
+                                    "<br>".join("{}: {}".format(os.path.basename(clip), error) for clip, error in msg["errors"][:10])))
+            else:
+                self.statusbar.showMessage("Sequences extracted to {} directory".format(exportDir), 0)
 
-        self.statusbar.showMessage("Sequences extracted to {} directory".format(exportDir), 0)
+        self.clipExtractionThread.signal.connect(extraction_progress)
+        self.clipExtractionProgress.show()
+        self.clipExtractionThread.start()
 
 
     def generate_spectrogram(self):
@@ -1579,7 +1799,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
                 if not self.initialize_new_observation_vlc():
                     self.observationId = ""
-                    self.twEvents.setRowCount(0)
+                    self.eventsModel.set_events(None)
                     self.menu_options()
                     return "Error: loading observation problem"
 
@@ -1767,7 +1987,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
                     if not self.initialize_new_observation_vlc():
                         self.observationId = ''
-                        self.twEvents.setRowCount(0)
+                        self.eventsModel.set_events(None)
                         self.menu_options()
 
                 self.menu_options()
@@ -2000,9 +2220,93 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         save project every x minutes if current observation
         """
 
-        if self.observationId:
+        if not self.observationId:
+            return
+
+        if not self.projectFileName:
             logging.info("automatic backup")
             self.save_project_activated()
+            return
+
+        if not self.projectChanged:
+            return
+
+        if self.autosaveThread is not None and self.autosaveThread.isRunning():
+            logging.info("automatic backup already running")
+            return
+
+        logging.info("automatic backup")
+
+        self.pj["project_format_version"] = project_format_version
+        # changes made during the writing will set projectChanged again
+        self.projectChanged = False
+        self.autosaveJournalPosition = self.journal.position() if self.journal is not None else None
+        self.autosaveThread = AutosaveThread(self.projectFileName, self.project_writer(self.projectFileName))
+        self.autosaveThread.signal.connect(self.automatic_backup_done)
+        self.autosaveThread.start()
+
+
+    def automatic_backup_done(self, msg):
+        """
+        receive result of automatic backup thread
+        """
+        if "error" in msg:
+            self.projectChanged = True
+            QMessageBox.critical(self, programName, "The project file can not be saved! {}".format(msg["error"]))
+
+        if "saved" in msg and self.autosaveJournalPosition is not None:
+            self.discard_journal(msg["saved"], self.autosaveJournalPosition)
+        self.autosaveJournalPosition = None
+
+
+    def project_writer(self, projectFileName):
+        """
+        take a snapshot of the current project and return function writing it in projectFileName
+        (the function can run in a thread)
+        """
+        if self.projectStorage == project_db.SQLITE:
+            snapshot = self.projectDbWriter.snapshot(self.pj, projectFileName)
+            return lambda: self.projectDbWriter.write(snapshot)
+
+        # events still stored in a project database are read: the database file can be replaced
+        project_db.detach_events(self.pj)
+        snapshot, compression = self.projectSerializer.snapshot(self.pj), self.projectCompression
+        return lambda: project_file.write_atomic(projectFileName, self.projectSerializer.render(snapshot), compression)
+
+
+    def wait_automatic_backup(self):
+        """
+        wait for end of automatic backup writing
+        """
+        if self.autosaveThread is not None:
+            self.autosaveThread.wait()
+
+
+    def run_analysis(self, analysis, done, observations=None):
+        """
+        run analysis on a snapshot of the project in a thread
+        the user can continue coding during the analysis
+
+        analysis: function(snapshot) returning the result (runs in the thread)
+        done: function(result) called in the GUI thread
+        observations: ids of observations needed by analysis (all observations if None)
+        """
+        snapshot = self.projectSnapshots.take(self.pj, observations)
+        thread = AnalysisThread(lambda: analysis(snapshot))
+        self.analysisThreads.append(thread)
+
+        def analysis_done(msg):
+            self.analysisThreads.remove(thread)
+            if not self.analysisThreads:
+                self.statusbar.showMessage("", 0)
+            if "error" in msg:
+                QMessageBox.critical(self, programName, "Error during the analysis:<br>{}".format(msg["error"]))
+            else:
+                done(msg["result"])
+
+        thread.signal.connect(analysis_done)
+        self.statusbar.showMessage("Analysis in progress...", 0)
+        thread.start()
 
 
     def deselectSubject(self):
@@ -2131,12 +2435,15 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
             self.ffmpeg_cache_dir = preferencesWindow.leFFmpegCacheDir.text()
             self.ffmpeg_cache_dir_max_size = preferencesWindow.sbFFmpegCacheDirMaxSize.value()
+            self.frameCache.resize(frame_decoder.cache_size(self.ffmpeg_cache_dir_max_size))
 
             # frame-by-frame
             self.frame_resize = preferencesWindow.sbFrameResize.value()
 
             # delete files in imageDirectory f frame_resize changed
             if self.frame_resize != mem_frame_resize:
+                self.close_frame_decoders()
+                self.frameCache.clear()
                 # check temp dir for images from ffmpeg
                 if not self.ffmpeg_cache_dir:
                     self.imageDirectory = tempfile.gettempdir()
@@ -2148,6 +2455,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                         os.remove(self.imageDirectory + os.sep + f)
                     except:
                         pass
+                if self.imageCacheIndex is not None and self.imageCacheIndex.directory == self.imageDirectory:
+                    self.imageCacheIndex.reset()
 
             self.frame_bitmap_format = preferencesWindow.cbFrameBitmapFormat.currentText()
 
@@ -2267,6 +2576,84 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
 
 
+    def decoded_frame(self, mediaFile, frame, fps):
+        """
+        return QPixmap of frame of media file decoded by a persistent ffmpeg process or read from the frame cache
+        (see frame_decoder) or None if the frame can not be decoded (frames are then extracted in image files)
+        """
+        if mediaFile not in self.frameDecoders:
+            decoder = frame_decoder.frame_decoder(self.ffmpeg_bin, mediaFile, fps, self.frame_resize)
+            self.frameDecoders[mediaFile] = frame_decoder.MediaFrames(decoder, self.frameCache) if decoder is not None else None
+        decoder = self.frameDecoders[mediaFile]
+        if decoder is None:
+            return None
+
+        data = decoder.frame(max(0, frame - 1))
+        if data is None:
+            return None
+        return QPixmap.fromImage(QImage(data, decoder.width, decoder.height, decoder.width * 3, QImage.Format_RGB888))
+
+
+    def extracted_pixmap(self, mediaFile, frame, fps):
+        """
+        return QPixmap of frame extracted in the frame cache directory (see extracted_frame)
+        or None if the frame can not be extracted
+        an indexed frame that can not be loaded (file deleted from directory) is extracted again
+        """
+        img = self.extracted_frame(mediaFile, frame, fps)
+        if img is None:
+            return None
+        pixmap = QPixmap(img)
+        if pixmap.isNull():
+            logging.warning("image can not be loaded: {}".format(img))
+            self.imageCacheIndex.discard(os.path.basename(img).rpartition("_")[0])
+            img = self.extracted_frame(mediaFile, frame, fps)
+            if img is None:
+                return None
+            pixmap = QPixmap(img)
+            # check if jpg filter available if not use png
+            if pixmap.isNull():
+                self.frame_bitmap_format = "PNG"
+        return pixmap
+
+
+    def extracted_frame(self, mediaFile, frame, fps):
+        """
+        return path of image of frame of media file extracted by ffmpeg in the frame cache directory
+        or None if the frame can not be extracted
+        the images are extracted by groups of one second and indexed (see image_cache)
+        """
+        md5FileName = hashlib.md5(mediaFile.encode("utf-8")).hexdigest()
+        extension = self.frame_bitmap_format.lower()
+
+        # second of the group of frames and number of frame in group (first frame is 1)
+        second = int((frame - 1) / fps)
+        frame_in_second = round(frame - second * fps)
+        if frame_in_second == 0:
+            frame_in_second += 1
+        logging.debug("second: {}  frame: {}".format(second, frame_in_second))
+
+        group = image_cache.group_name(md5FileName, second)
+        img = self.imageCacheIndex.get(group, frame_in_second, extension)
+        if img is None:
+            extract_frames(self.ffmpeg_bin, second, mediaFile, str(round(fps) + 1), self.imageDirectory, md5FileName, extension, self.frame_resize)
+            self.imageCacheIndex.add(group, extension, round(fps) + 1)
+            img = self.imageCacheIndex.frame_file(group, frame_in_second, extension)
+            if img is None:
+                logging.warning("image not found: {} frame {}".format(group, frame_in_second))
+        return img
+
+
+    def close_frame_decoders(self):
+        """
+        stop the ffmpeg processes decoding frames
+        """
+        for decoder in self.frameDecoders.values():
+            if decoder is not None:
+                decoder.close()
+        self.frameDecoders = {}
+
+
     def ffmpegTimerOut(self):
         """
         triggered when frame-by-frame mode is activated:
@@ -2302,45 +2689,13 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         if "visualize_spectrogram" in self.pj[OBSERVATIONS][self.observationId] and self.pj[OBSERVATIONS][self.observationId]["visualize_spectrogram"]:
             self.timer_spectro_out()
 
-        md5FileName = hashlib.md5(currentMedia.encode("utf-8")).hexdigest()
-
-
-        if "BORIS@{md5FileName}-{second}".format(md5FileName=md5FileName, second=int(frameCurrentMedia / fps)) not in self.imagesList:
-
-            extract_frames(self.ffmpeg_bin, int(frameCurrentMedia / fps), currentMedia, str(round(fps) +1), self.imageDirectory, md5FileName, self.frame_bitmap_format.lower(), self.frame_resize)
-
-            self.imagesList.update([f.replace(self.imageDirectory + os.sep, "").split("_")[0] for f in glob.glob(self.imageDirectory + os.sep + "BORIS@*")])
-
-
-        logging.debug("images 1 list: {}".format(self.imagesList))
-
-        second1 = int((frameCurrentMedia -1 )/ fps)
-        frame1 = round((frameCurrentMedia - int((frameCurrentMedia -1)/ fps) * fps))
-        if frame1 == 0:
-            frame1 += 1
-        logging.debug("second1: {}  frame1: {}".format(second1,frame1))
-        #logging.debug("image 1 {}".format("{}-{} {}".format(md5FileName, int(frameCurrentMedia / fps), frame1)))
-
-        img = "{imageDir}{sep}BORIS@{fileName}-{second}_{frame}.{extension}".format(imageDir=self.imageDirectory,
-                                                                                    sep=os.sep,
-                                                                                    fileName=md5FileName,
-                                                                                    second=second1,
-                                                                                    frame=frame1,
-                                                                                    extension=self.frame_bitmap_format.lower())
-
-        logging.debug("image1: {}".format(img))
-        if not os.path.isfile(img):
-            logging.warning("image 1 not found: {0}".format(img))
-            extract_frames(self.ffmpeg_bin, int(frameCurrentMedia / fps), currentMedia, str(round(fps) + 1), self.imageDirectory, md5FileName, self.frame_bitmap_format.lower(), self.frame_resize)
-            if not os.path.isfile(img):
-                logging.warning("image 1 still not found: {0}".format(img))
+        # frame decoded by a persistent ffmpeg process or extracted in image files
+        self.pixmap = self.decoded_frame(currentMedia, frameCurrentMedia, fps)
+        if self.pixmap is None:
+            self.pixmap = self.extracted_pixmap(currentMedia, frameCurrentMedia, fps)
+            if self.pixmap is None:
                 return
 
-        self.pixmap = QPixmap(img)
-        # check if jpg filter available if not use png
-        if self.pixmap.isNull():
-            self.frame_bitmap_format = "PNG"
-
         if self.second_player():
 
             requiredFrame2 = self.FFmpegGlobalFrame2 + 1
@@ -2367,33 +2722,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                         requiredFrame = int(requiredFrame2 + self.pj[OBSERVATIONS][self.observationId][TIME_OFFSET_SECOND_PLAYER] * fps)
 
             currentMedia2, frameCurrentMedia2 = self.getCurrentMediaByFrame(PLAYER2, requiredFrame2, fps)
-            md5FileName2 = hashlib.md5(currentMedia2.encode("utf-8")).hexdigest()
-            if "BORIS@{md5FileName}-{second}".format(md5FileName=md5FileName2,
-                                                     second=int(frameCurrentMedia2 / fps)) not in self.imagesList:
-                extract_frames(self.ffmpeg_bin, int(frameCurrentMedia2 / fps), currentMedia2, str(round(fps) + 1),
-                               self.imageDirectory, md5FileName2, self.frame_bitmap_format.lower(), self.frame_resize)
-
-                self.imagesList.update([f.replace(self.imageDirectory + os.sep, "").split("_")[0] for f in
-                                        glob.glob(self.imageDirectory + os.sep + "BORIS@*")])
-
-            second2 = int((frameCurrentMedia2 - 1) / fps)
-            frame2 = round((frameCurrentMedia2 - int((frameCurrentMedia2 -1)/ fps) * fps))
-            if frame2 == 0:
-                frame2 += 1
-
-            img2 = "{imageDir}{sep}BORIS@{fileName}-{second}_{frame}.{extension}".format(imageDir=self.imageDirectory,
-                                                                                        sep=os.sep,
-                                                                                        fileName=md5FileName2,
-                                                                                        second=second2,
-                                                                                        frame=frame2,
-                                                                                        extension=self.frame_bitmap_format.lower())
-            if not os.path.isfile(img2):
-                logging.warning("image 2 not found: {0}".format(img2))
-                extract_frames(self.ffmpeg_bin, int(frameCurrentMedia2 / fps), currentMedia2, str(round(fps) +1), self.imageDirectory, md5FileName2, self.frame_bitmap_format.lower(), self.frame_resize)
-                if not os.path.isfile(img2):
-                    logging.warning("image 2 still not found: {0}".format(img2))
+            self.pixmap2 = self.decoded_frame(currentMedia2, frameCurrentMedia2, fps)
+            if self.pixmap2 is None:
+                self.pixmap2 = self.extracted_pixmap(currentMedia2, frameCurrentMedia2, fps)
+                if self.pixmap2 is None:
                     return
-            self.pixmap2 = QPixmap(img2)
 
         if self.detachFrameViewer or self.second_player():   # frame viewer detached or 2 players
             self.create_frame_viewer()
@@ -2461,27 +2794,13 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                              ))
 
         # extract State events
-        StateBehaviorsCodes = [self.pj[ETHOGRAM][x]["code"] for x in [y for y in self.pj[ETHOGRAM]
-                                if "State" in self.pj[ETHOGRAM][y][TYPE]]]
+        StateBehaviorsCodes = self.ethogram_index().state_codes
 
-        self.currentStates = {}
-
-        # add states for no focal subject
-        self.currentStates[""] = []
-        for sbc in StateBehaviorsCodes:
-            if len([x[ pj_obs_fields["code"]] for x in self.pj[OBSERVATIONS][self.observationId][EVENTS]
-                       if x[pj_obs_fields["subject"]] == "" and x[pj_obs_fields["code"]] == sbc and x[pj_obs_fields["time"]] <= currentTime /1000]) % 2: # test if odd
-                self.currentStates[""].append(sbc)
-
-        # add states for all configured subjects
-        for idx in self.pj[SUBJECTS]:
-
-            # add subject index
-            self.currentStates[ idx ] = []
-            for sbc in StateBehaviorsCodes:
-                if len([x[pj_obs_fields["code"]] for x in self.pj[OBSERVATIONS][self.observationId][EVENTS]
-                           if x[pj_obs_fields["subject"]] == self.pj[SUBJECTS][idx]["name"] and x[pj_obs_fields["code"]] == sbc and x[pj_obs_fields["time"]] <= currentTime / 1000 ]) % 2: # test if odd
-                    self.currentStates[idx].append(sbc)
+        # add states for all configured subjects and for no focal subject
+        self.currentStates = self.get_current_states_by_subject(StateBehaviorsCodes,
+                                                                self.obs_events(self.observationId),
+                                                                dict(self.pj[SUBJECTS], **{"": {"name": ""}}),
+                                                                currentTime / 1000)
 
         # show current states
         if self.currentSubject:
@@ -3106,33 +3425,48 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         return QMainWindow.eventFilter(self, source, event)
 
 
+    def obs_events(self, obsId):
+        """
+        return the indexed events (EventStore) of observation obsId
+        """
+        return event_store.observation_events(self.pj[OBSERVATIONS][obsId])
+
+
     def loadEventsInTW(self, obsId):
         """
         load events in table widget and update START/STOP
+        the events table is a view of the event store of observation
         """
 
-        self.twEvents.setRowCount(len(self.pj[OBSERVATIONS][obsId][EVENTS]))
-        row = 0
+        stateEventsList = self.ethogram_index().state_codes
 
-        for event in self.pj[OBSERVATIONS][obsId][EVENTS]:
+        self.eventsModel.set_events(self.obs_events(obsId), stateEventsList, self.convertTime)
 
-            for field_type in tw_events_fields:
+        self.attach_journal()
 
-                if field_type in pj_events_fields:
 
-                    field = event[pj_obs_fields[field_type]]
-                    if field_type == "time":
-                        field = str( self.convertTime( field) )
+    def attach_journal(self):
+        """
+        record the modifications of events of the current observation in the journal of the project file
+        """
+        if self.journal is not None and self.journal.projectFileName != self.projectFileName:
+            self.journal.close()
+            self.journal = None
 
-                    twi = QTableWidgetItem(field )
-                    self.twEvents.setItem(row, tw_obs_fields[field_type], twi)
+        if not self.projectFileName or not self.observationId or self.observationId not in self.pj[OBSERVATIONS]:
+            return
 
-                else:
-                    self.twEvents.setItem(row, tw_obs_fields[field_type], QTableWidgetItem(""))
+        if self.journal is None:
+            self.journal = project_file.EventJournal(self.projectFileName)
+        self.journal.attach(self.observationId, self.pj[OBSERVATIONS][self.observationId], self.obs_events(self.observationId))
 
-            row += 1
 
-        self.update_events_start_stop()
+    def discard_journal(self, projectFileName, position=None):
+        """
+        remove the records of the events journal saved in projectFileName
+        """
+        if self.journal is not None and self.journal.projectFileName == projectFileName:
+            self.journal.discard(position)
 
 
     def selectObservations(self, mode):
@@ -3627,6 +3961,9 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 # title of dock widget
                 self.dwObservations.setWindowTitle("""Events for "{}" observation""".format(self.observationId))
 
+                # load events in table widget
+                self.loadEventsInTW(self.observationId)
+
                 if self.pj[OBSERVATIONS][self.observationId][TYPE] in [LIVE]:
 
                     self.playerType = LIVE
@@ -3635,10 +3972,6 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 else:
                     self.playerType = VLC
 
-                    # load events in table widget
-                    if mode == EDIT:
-                        self.loadEventsInTW(self.observationId)
-
                     self.initialize_new_observation_vlc()
 
                 self.menu_options()
@@ -3679,6 +4012,13 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         self.observationId = ""
 
+        if self.stateTracker:
+            self.stateTracker.detach()
+            self.stateTracker = None
+
+        if self.journal is not None:
+            self.journal.detach()
+
         self.close_tool_windows()
 
         if self.playerType == LIVE:
@@ -3741,7 +4081,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
                 self.FFmpegTimer.stop()
                 self.FFmpegGlobalFrame = 0
-                self.imagesList = set()
+                self.close_frame_decoders()
+                self.frameCache.clear()
             except:
                 pass
 
@@ -3754,7 +4095,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.lbFocalSubject.setVisible(False)
         self.lbCurrentStates.setVisible(False)
 
-        self.twEvents.setRowCount(0)
+        self.eventsModel.set_events(None)
 
         self.lbTime.clear()
         self.lbSubject.clear()
@@ -4008,49 +4349,28 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.lbTimeOffset.clear()
 
 
+    def ethogram_index(self):
+        """
+        return the lookup tables of the ethogram (rebuilt if the ethogram was replaced)
+        """
+        if self.ethogramIndex is None or self.ethogramIndex.ethogram is not self.pj[ETHOGRAM]:
+            self.ethogramIndex = ethogram_index.EthogramIndex(self.pj[ETHOGRAM])
+        return self.ethogramIndex
+
+
     def eventType(self, code):
         """
         returns type of event for code
         """
-
-        for idx in self.pj[ETHOGRAM]:
-            if self.pj[ETHOGRAM][idx]['code'] == code:
-                return self.pj[ETHOGRAM][idx][TYPE]
-        return None
+        return self.ethogram_index().event_type(code)
 
 
     def loadEventsInDB(self, selectedSubjects, selectedObservations, selectedBehaviors):
         """
         populate the db databse with events from selectedObservations, selectedSubjects and selectedBehaviors
+        (see project_db.load_events_in_db)
         """
-        db = sqlite3.connect(":memory:")
-        db.row_factory = sqlite3.Row
-
-        cursor = db.cursor()
-
-        cursor.execute("CREATE TABLE events (observation TEXT, subject TEXT, code TEXT, type TEXT, modifiers TEXT, occurence FLOAT, comment TEXT);")
-
-        for subject_to_analyze in selectedSubjects:
-
-            for obsId in selectedObservations:
-
-                for event in self.pj[OBSERVATIONS][obsId][EVENTS]:
-
-                    if event[2] in selectedBehaviors:
-
-                        # extract time, code, modifier and comment ( time:0, subject:1, code:2, modifier:3, comment:4 )
-                        if (subject_to_analyze == NO_FOCAL_SUBJECT and event[1] == "") \
-                            or ( event[1] == subject_to_analyze ):
-
-                            subjectStr = NO_FOCAL_SUBJECT if event[1] == "" else  event[1]
-
-                            eventType = STATE if STATE in self.eventType(event[2]).upper() else POINT
-
-                            r = cursor.execute("""INSERT INTO events (observation, subject, code, type, modifiers, occurence, comment) VALUES (?,?,?,?,?,?,?)""",
-                            (obsId, subjectStr, event[2], eventType, event[3], str(event[0]), event[4]))
-
-        db.commit()
-        return cursor
+        return project_db.load_events_in_db(self.pj, self.eventType, selectedSubjects, selectedObservations, selectedBehaviors)
 
 
     def extract_observed_subjects(self, selected_observations):
@@ -4265,240 +4585,152 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         time budget (by behavior or category)
         """
 
-        def time_budget_analysis_by_category(cursor, plot_parameters, by_category=False):
+        def time_budget_analysis_by_category(pj, cursor, plot_parameters, by_category=False):
+            """
+            pj can be a project snapshot (analysis in a thread)
+            """
 
             categories = {}
-            out = []
 
-            for subject in plot_parameters["selected subjects"]:
-                out_cat = []
+            event_type = ethogram_index.EthogramIndex(pj[ETHOGRAM]).event_type
+            out, subjects_rows = time_budget.time_budget(cursor, plot_parameters, event_type, single_observation=len(selectedObservations) == 1)
+
+            if by_category:
+                # category of behaviors (first behavior with code)
+                behavior_category = {}
+                for idx in pj[ETHOGRAM]:
+                    if "category" in pj[ETHOGRAM][idx]:
+                        behavior_category.setdefault(pj[ETHOGRAM][idx]["code"], pj[ETHOGRAM][idx]["category"])
 
-                categories[subject] = {}
+                for subject, out_cat in subjects_rows:
+                    categories[subject] = {}
+                    for behav in out_cat:
+                        category = behavior_category.get(behav["behavior"], "")
 
-                print("selected behaviors", plot_parameters["selected behaviors"])
+                        if category in categories[subject]:
+                            if behav["duration"] != "-" and categories[subject][category]["duration"] != "-":
+                                categories[subject][category]["duration"] += behav["duration"]
+                            else:
+                                categories[subject][category]["duration"] = "-"
+                            categories[subject][category]["number"] += behav["number"]
+                        else:
+                            categories[subject][category] = {"duration": behav["duration"], "number": behav["number"]}
+            else:
+                for subject in plot_parameters["selected subjects"]:
+                    categories[subject] = {}
+
+            # rows sorted by selected subjects and behaviors
+            rows_by_behavior = {}
+            for row in out:
+                rows_by_behavior.setdefault((row["subject"], row["behavior"]), []).append(row)
+
+            out_sorted = []
+            for subject in plot_parameters["selected subjects"]:
                 for behavior in plot_parameters["selected behaviors"]:
+                    out_sorted.extend(rows_by_behavior.get((subject, behavior), []))
 
-                    if plot_parameters["include modifiers"]:
+            return out_sorted, categories
 
-                        cursor.execute("SELECT distinct modifiers FROM events WHERE subject = ? AND code = ?", (subject, behavior))
-                        distinct_modifiers = list(cursor.fetchall())
-
-                        if not distinct_modifiers:
-                            if not plot_parameters["exclude behaviors"]:
-                                out.append({"subject": subject,
-                                            "behavior": behavior,
-                                            "modifiers": "-",
-                                            "duration": "-",
-                                            "duration_mean": "-",
-                                            "duration_stdev": "-",
-                                            "number": 0,
-                                            "inter_duration_mean": "-",
-                                            "inter_duration_stdev": "-"})
-                            continue
 
-                        if POINT in self.eventType(behavior).upper():
-                            for modifier in distinct_modifiers:
-                                if len(selectedObservations) > 1:
-                                    cursor.execute("SELECT occurence,observation FROM events WHERE subject = ? AND code = ? AND modifiers = ? ORDER BY observation, occurence",
-                                                   (subject, behavior, modifier[0]))
-                                else:
-                                    cursor.execute("SELECT occurence,observation FROM events WHERE subject = ? AND code = ? AND modifiers = ? AND occurence BETWEEN ? and ? ORDER BY observation, occurence",
-                                                   (subject, behavior, modifier[0], str(plot_parameters["start time"]), str(plot_parameters["end time"])))
+        def time_budget_results(out, categories):
+            """
+            show results of time budget analysis
+            """
 
-                                rows = cursor.fetchall()
+            # widget for results visualization
+            self.tb = timeBudgetResults(logging.getLogger().getEffectiveLevel(), self.pj)
+
+            # observations list
+            self.tb.label.setText("Selected observations")
+            for obs in selectedObservations:
+                self.tb.lw.addItem(obs)
+
+            # media length
+            if len(selectedObservations) > 1:
+                if selectedObsTotalMediaLength:
+                    if self.timeFormat == HHMMSS:
+                        self.tb.lbTotalObservedTime.setText("Total media length: {}".format(seconds2time(selectedObsTotalMediaLength)))
+                    if self.timeFormat == S:
+                        self.tb.lbTotalObservedTime.setText("Total media length: {:0.3f}".format(float(selectedObsTotalMediaLength)))
+                else:
+                    self.tb.lbTotalObservedTime.setText("Total media length: not available")
+            else:
 
-                                # inter events duration
-                                all_event_interdurations = []
-                                for idx, row in enumerate(rows):
-                                    if idx and row[1] == rows[idx - 1][1]:
-                                        all_event_interdurations.append(float(row[0]) - float(rows[idx - 1][0]))
+                if self.timeFormat == HHMMSS:
+                    self.tb.lbTotalObservedTime.setText("Analysis from {} to {}".format(seconds2time(plot_parameters["start time"]), seconds2time(plot_parameters["end time"])))
+                if self.timeFormat == S:
+                    self.tb.lbTotalObservedTime.setText("Analysis from {:0.3f} to {:0.3f} s".format(float(plot_parameters["start time"]), float(plot_parameters["end time"])))
 
-                                out_cat.append({"subject": subject,
-                                            "behavior": behavior,
-                                            "modifiers": modifier[0],
-                                            "duration": "-",
-                                            "duration_mean": "-",
-                                            "duration_stdev": "-",
-                                            "number": len(rows),
-                                            "inter_duration_mean": round(statistics.mean(all_event_interdurations), 3) if len(all_event_interdurations) else "NA",
-                                            "inter_duration_stdev": round(statistics.stdev(all_event_interdurations), 3) if len(all_event_interdurations) > 1 else "NA"
-                                            })
 
 
-                        if STATE in self.eventType(behavior).upper():
-                            for modifier in distinct_modifiers:
-                                cursor.execute("SELECT occurence,observation FROM events WHERE subject = ? AND code = ? AND modifiers = ? ORDER BY observation, occurence",
-                                              (subject, behavior, modifier[0]))
-                                rows = list(cursor.fetchall())
-                                if len(rows) % 2:
-                                    out.append({"subject": subject, "behavior": behavior,
-                                                "modifiers": modifier[0], "duration": UNPAIRED,
-                                                "duration_mean": UNPAIRED, "duration_stdev": UNPAIRED,
-                                                "number": UNPAIRED, "inter_duration_mean": UNPAIRED,
-                                                "inter_duration_stdev": UNPAIRED})
-                                else:
-                                    all_event_durations, all_event_interdurations = [], []
-                                    for idx, row in enumerate(rows):
-                                        # event
-                                        if idx % 2 == 0:
-                                            new_init, new_end = float(row[0]), float(rows[idx + 1][0])
-                                            if len(selectedObservations) == 1:
-                                                if (new_init < plot_parameters["start time"] and new_end < plot_parameters["start time"]) \
-                                                   or \
-                                                   (new_init > plot_parameters["end time"] and new_end > plot_parameters["end time"]):
-                                                    continue
-
-                                                if new_init < plot_parameters["start time"]:
-                                                    new_init = float(plot_parameters["start time"])
-                                                if new_end > plot_parameters["end time"]:
-                                                    new_end = float(plot_parameters["end time"])
-
-                                            all_event_durations.append( new_end - new_init)
-
-                                        # inter event if same observation
-                                        if idx % 2 and idx != len(rows) - 1 and row[1] == rows[idx + 1][1]:
-                                            if plot_parameters["start time"] <= row[0] <= plot_parameters["end time"] and plot_parameters["start time"] <= rows[idx + 1][0] <= plot_parameters["end time"]:
-                                                all_event_interdurations.append(float(rows[idx + 1][0]) - float(row[0]))
-
-                                            #all_event_interdurations.append(float( rows[idx + 1][0]) - float(row[0]))
-
-                                    out_cat.append({"subject": subject,
-                                                "behavior": behavior,
-                                                "modifiers": modifier[0],
-                                                "duration": round(sum(all_event_durations), 3),
-                                                "duration_mean": round(statistics.mean(all_event_durations), 3) if len(all_event_durations) else "NA",
-                                                "duration_stdev": round(statistics.stdev(all_event_durations), 3) if len(all_event_durations) > 1 else "NA",
-                                                "number": len(all_event_durations),
-                                                "inter_duration_mean": round(statistics.mean(all_event_interdurations), 3) if len(all_event_interdurations) else "NA",
-                                                "inter_duration_stdev": round(statistics.stdev(all_event_interdurations), 3) if len(all_event_interdurations) > 1 else "NA"
-                                                })
-
-                    else:  # no modifiers
+            if mode == "by_behavior":
+                tb_fields = ["Subject", "Behavior", "Modifiers", "Total number", "Total duration (s)",
+                             "Duration mean (s)", "Duration std dev", "inter-event intervals mean (s)",
+                             "inter-event intervals std dev", "% of total media length"]
 
-                        if POINT in self.eventType(behavior).upper():
+                fields = ["subject", "behavior",  "modifiers", "number", "duration", "duration_mean", "duration_stdev", "inter_duration_mean", "inter_duration_stdev"]
+                self.tb.twTB.setColumnCount(len(tb_fields))
+                self.tb.twTB.setHorizontalHeaderLabels(tb_fields)
 
-                            if len(selectedObservations) > 1:
-                                cursor.execute("SELECT occurence,observation FROM events WHERE subject = ? AND code = ? ORDER BY observation, occurence", (subject, behavior))
-                            else:
-                                cursor.execute("SELECT occurence,observation FROM events WHERE subject = ? AND code = ? AND occurence BETWEEN ? and ? ORDER BY observation, occurence",
-                                               (subject, behavior, str(plot_parameters["start time"]), str(plot_parameters["end time"])))
-
-                            rows = list(cursor.fetchall())
-
-                            if len(selectedObservations) == 1:
-                                new_rows = []
-                                for occurence, observation in rows:
-                                    new_occurence = max(float(plot_parameters["start time"]), occurence)
-                                    new_occurence = min( new_occurence, float( plot_parameters["end time"]) )
-                                    new_rows.append( [new_occurence, observation])
-                                rows = list(new_rows)
-
-                            if not len(rows):
-                                if not plot_parameters["exclude behaviors"]:
-                                    out.append({"subject": subject, "behavior": behavior, "modifiers": "NA",
-                                                "duration": "-", "duration_mean": "-", "duration_stdev": "-", "number": 0,
-                                                "inter_duration_mean": "-", "inter_duration_stdev": "-"})
-                                continue
+                for row in out:
+                    self.tb.twTB.setRowCount(self.tb.twTB.rowCount() + 1)
+                    column = 0
+                    for field in fields:
+                        item = QTableWidgetItem(str(row[field]).replace(" ()", ""))
+                        # no modif allowed
+                        item.setFlags(Qt.ItemIsEnabled)
+                        self.tb.twTB.setItem(self.tb.twTB.rowCount() - 1, column , item)
+                        column += 1
 
-                            # inter events duration
-                            all_event_interdurations = []
-                            for idx, row in enumerate(rows):
-                                if idx and row[1] == rows[idx - 1][1]:
-                                    all_event_interdurations.append(float(row[0]) - float(rows[idx-1][0]))
+                    # % of total time
+                    if row["duration"] != "-" and row["duration"] != 0 and row["duration"] != UNPAIRED and selectedObsTotalMediaLength:
+                        if len(selectedObservations) > 1:
+                            item = QTableWidgetItem(str(round(row["duration"] / float(selectedObsTotalMediaLength) * 100, 1)))
+                        else:
+                            item = QTableWidgetItem(str(round(row["duration"] / float(plot_parameters["end time"] - plot_parameters["start time"]) * 100, 1)))
+                    else:
+                        item = QTableWidgetItem("-")
 
-                            out_cat.append({"subject": subject,
-                                        "behavior": behavior,
-                                        "modifiers": "NA",
-                                        "duration": "-",
-                                        "duration_mean": "-",
-                                        "duration_stdev": "-",
-                                        "number": len(rows),
-                                        "inter_duration_mean" : round(statistics.mean(all_event_interdurations), 3) if len(all_event_interdurations) else "NA",
-                                        "inter_duration_stdev": round(statistics.stdev(all_event_interdurations), 3) if len(all_event_interdurations) > 1 else "NA"
-                                        })
+                    item.setFlags(Qt.ItemIsEnabled)
+                    self.tb.twTB.setItem(self.tb.twTB.rowCount() - 1, column, item)
 
+            if mode == "by_category":
+                tb_fields = ["Subject", "Category", "Total number", "Total duration (s)"]
+                fields = ["number", "duration"]
+                self.tb.twTB.setColumnCount(len(tb_fields))
+                self.tb.twTB.setHorizontalHeaderLabels(tb_fields)
 
-                        if STATE in self.eventType(behavior).upper():
-                            cursor.execute( "SELECT occurence, observation FROM events where subject = ? AND code = ? ORDER BY observation, occurence", (subject, behavior))
-                            rows = list(cursor.fetchall())
-
-                            if not len(rows):
-                                if not plot_parameters["exclude behaviors"]: # include behaviors without events
-                                    out.append({"subject": subject , "behavior": behavior,
-                                                "modifiers": "NA", "duration": 0, "duration_mean": 0,
-                                                "duration_stdev": "NA", "number": 0, "inter_duration_mean": "-",
-                                                "inter_duration_stdev": "-"})
-                                continue
-                            if len(rows) % 2:
-                                out.append({"subject": subject, "behavior": behavior, "modifiers": "NA",
-                                            "duration": UNPAIRED, "duration_mean": UNPAIRED, "duration_stdev": UNPAIRED,
-                                            "number": UNPAIRED, "inter_duration_mean": UNPAIRED,
-                                            "inter_duration_stdev": UNPAIRED})
-                            else:
-                                all_event_durations, all_event_interdurations = [], []
-                                for idx, row in enumerate(rows):
-                                    # event
-                                    if idx % 2 == 0:
-                                        new_init, new_end = float(row[0]), float(rows[idx + 1][0])
-                                        if len(selectedObservations) == 1:
-                                            if ((new_init < plot_parameters["start time"] and new_end < plot_parameters["start time"])
-                                               or
-                                               (new_init > plot_parameters["end time"] and new_end > plot_parameters["end time"])):
-                                                continue
-
-                                            if new_init < plot_parameters["start time"]:
-                                                new_init = float(plot_parameters["start time"])
-                                            if new_end > plot_parameters["end time"]:
-                                                new_end = float(plot_parameters["end time"])
-
-                                        all_event_durations.append( new_end - new_init)
-
-                                    # inter event if same observation
-                                    if idx % 2 and idx != len(rows) - 1 and row[1] == rows[idx + 1][1]:
-                                        if plot_parameters["start time"] <= row[0] <= plot_parameters["end time"] and plot_parameters["start time"] <= rows[idx + 1][0] <= plot_parameters["end time"]:
-                                            all_event_interdurations.append(float(rows[idx + 1][0]) - float(row[0]))
-
-                                out_cat.append({"subject": subject,
-                                            "behavior": behavior,
-                                            "modifiers": "NA",
-                                            "duration": round(sum(all_event_durations), 3),
-                                            "duration_mean": round(statistics.mean(all_event_durations), 3) if len(all_event_durations) else "NA",
-                                            "duration_stdev": round(statistics.stdev(all_event_durations), 3) if len(all_event_durations) > 1 else "NA",
-                                            "number": len(all_event_durations),
-                                            "inter_duration_mean": round(statistics.mean(all_event_interdurations), 3) if len(all_event_interdurations) else "NA",
-                                            "inter_duration_stdev": round(statistics.stdev(all_event_interdurations), 3) if len(all_event_interdurations) > 1 else "NA"
-                                            })
-
-                out += out_cat
-
-                if by_category: # and flagCategories:
+                for subject in categories:
 
-                    for behav in out_cat:
+                    for category in categories[subject]:
 
-                        try:
-                            category = [self.pj[ETHOGRAM][x]["category"] for x in self.pj[ETHOGRAM] if "category" in self.pj[ETHOGRAM][x] and self.pj[ETHOGRAM][x]["code"] == behav['behavior']][0]
-                        except:
-                            category = ""
+                        self.tb.twTB.setRowCount(self.tb.twTB.rowCount() + 1)
 
-                        if category in categories[subject]:
-                            if behav["duration"] != "-" and categories[subject][category]["duration"] != "-":
-                                categories[subject][category]["duration"] += behav["duration"]
-                            else:
-                                categories[subject][category]["duration"] = "-"
-                            categories[subject][category]["number"] += behav["number"]
+                        column = 0
+                        item = QTableWidgetItem(subject)
+                        item.setFlags(Qt.ItemIsEnabled)
+                        self.tb.twTB.setItem(self.tb.twTB.rowCount() - 1, column , item)
+
+                        column = 1
+                        if category == "":
+                            item = QTableWidgetItem("No category")
                         else:
-                            categories[subject][category] = {"duration": behav["duration"], "number": behav["number"]}
+                            item = QTableWidgetItem(category)
+                        item.setFlags(Qt.ItemIsEnabled)
+                        self.tb.twTB.setItem(self.tb.twTB.rowCount() - 1, column , item)
 
-            out_sorted = []
-            for subject in plot_parameters["selected subjects"]:
-                for behavior in plot_parameters["selected behaviors"]:
-                    for row in out:
-                        if row['subject'] == subject and row['behavior'] == behavior:
-                            out_sorted.append(row)
+                        for field in fields:
+                            column += 1
+                            item = QTableWidgetItem(str(categories[subject][category][field]))
+                            item.setFlags(Qt.ItemIsEnabled)
+                            item.setTextAlignment(Qt.AlignRight|Qt.AlignVCenter)
+                            self.tb.twTB.setItem(self.tb.twTB.rowCount() - 1, column , item)
 
 
-            ### http://stackoverflow.com/questions/673867/python-arbitrary-order-by
-            return out_sorted, categories
+
+            self.tb.twTB.resizeColumnsToContents()
+
+            self.tb.show()
 
 
         result, selectedObservations = self.selectObservations(MULTIPLE)
@@ -4549,8 +4781,14 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         # check if time_budget window must be used
         if (len(selectedObservations) > 1 and flagGroup) or (len(selectedObservations) == 1):
-            cursor = self.loadEventsInDB(plot_parameters["selected subjects"], selectedObservations, plot_parameters["selected behaviors"])
-            out, categories = time_budget_analysis_by_category(cursor, plot_parameters, by_category=(mode == "by_category"))
+
+            # analysis of a project snapshot in a thread: the coding can continue
+            def analysis(snapshot):
+                cursor = project_db.load_events_in_db(snapshot, ethogram_index.EthogramIndex(snapshot[ETHOGRAM]).event_type,
+                                                      plot_parameters["selected subjects"], selectedObservations, plot_parameters["selected behaviors"])
+                return time_budget_analysis_by_category(snapshot, cursor, plot_parameters, by_category=(mode == "by_category"))
+
+            self.run_analysis(analysis, lambda result: time_budget_results(*result), selectedObservations)
 
         else:
 
@@ -4593,7 +4831,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             for obsId in selectedObservations:
 
                 cursor = self.loadEventsInDB(plot_parameters["selected subjects"], [obsId], plot_parameters["selected behaviors"])
-                out, categories = time_budget_analysis_by_category(cursor, plot_parameters, by_category=(mode == "by_category"))
+                out, categories = time_budget_analysis_by_category(self.pj, cursor, plot_parameters, by_category=(mode == "by_category"))
 
                 rows = []
 
@@ -4705,100 +4943,6 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             return
 
 
-        # widget for results visualization
-        self.tb = timeBudgetResults(logging.getLogger().getEffectiveLevel(), self.pj)
-
-        # observations list
-        self.tb.label.setText("Selected observations")
-        for obs in selectedObservations:
-            self.tb.lw.addItem(obs)
-
-        # media length
-        if len(selectedObservations) > 1:
-            if selectedObsTotalMediaLength:
-                if self.timeFormat == HHMMSS:
-                    self.tb.lbTotalObservedTime.setText("Total media length: {}".format(seconds2time(selectedObsTotalMediaLength)))
-                if self.timeFormat == S:
-                    self.tb.lbTotalObservedTime.setText("Total media length: {:0.3f}".format(float(selectedObsTotalMediaLength)))
-            else:
-                self.tb.lbTotalObservedTime.setText("Total media length: not available")
-        else:
-
-            if self.timeFormat == HHMMSS:
-                self.tb.lbTotalObservedTime.setText("Analysis from {} to {}".format(seconds2time(plot_parameters["start time"]), seconds2time(plot_parameters["end time"])))
-            if self.timeFormat == S:
-                self.tb.lbTotalObservedTime.setText("Analysis from {:0.3f} to {:0.3f} s".format(float(plot_parameters["start time"]), float(plot_parameters["end time"])))
-
-
-
-        if mode == "by_behavior":
-            tb_fields = ["Subject", "Behavior", "Modifiers", "Total number", "Total duration (s)",
-                         "Duration mean (s)", "Duration std dev", "inter-event intervals mean (s)",
-                         "inter-event intervals std dev", "% of total media length"]
-
-            fields = ["subject", "behavior",  "modifiers", "number", "duration", "duration_mean", "duration_stdev", "inter_duration_mean", "inter_duration_stdev"]
-            self.tb.twTB.setColumnCount(len(tb_fields))
-            self.tb.twTB.setHorizontalHeaderLabels(tb_fields)
-
-            for row in out:
-                self.tb.twTB.setRowCount(self.tb.twTB.rowCount() + 1)
-                column = 0
-                for field in fields:
-                    item = QTableWidgetItem(str(row[field]).replace(" ()", ""))
-                    # no modif allowed
-                    item.setFlags(Qt.ItemIsEnabled)
-                    self.tb.twTB.setItem(self.tb.twTB.rowCount() - 1, column , item)
-                    column += 1
-
-                # % of total time
-                if row["duration"] != "-" and row["duration"] != 0 and row["duration"] != UNPAIRED and selectedObsTotalMediaLength:
-                    if len(selectedObservations) > 1:
-                        item = QTableWidgetItem(str(round(row["duration"] / float(selectedObsTotalMediaLength) * 100, 1)))
-                    else:
-                        item = QTableWidgetItem(str(round(row["duration"] / float(plot_parameters["end time"] - plot_parameters["start time"]) * 100, 1)))
-                else:
-                    item = QTableWidgetItem("-")
-
-                item.setFlags(Qt.ItemIsEnabled)
-                self.tb.twTB.setItem(self.tb.twTB.rowCount() - 1, column, item)
-
-        if mode == "by_category":
-            tb_fields = ["Subject", "Category", "Total number", "Total duration (s)"]
-            fields = ["number", "duration"]
-            self.tb.twTB.setColumnCount(len(tb_fields))
-            self.tb.twTB.setHorizontalHeaderLabels(tb_fields)
-
-            for subject in categories:
-
-                for category in categories[subject]:
-
-                    self.tb.twTB.setRowCount(self.tb.twTB.rowCount() + 1)
-
-                    column = 0
-                    item = QTableWidgetItem(subject)
-                    item.setFlags(Qt.ItemIsEnabled)
-                    self.tb.twTB.setItem(self.tb.twTB.rowCount() - 1, column , item)
-
-                    column = 1
-                    if category == "":
-                        item = QTableWidgetItem("No category")
-                    else:
-                        item = QTableWidgetItem(category)
-                    item.setFlags(Qt.ItemIsEnabled)
-                    self.tb.twTB.setItem(self.tb.twTB.rowCount() - 1, column , item)
-
-                    for field in fields:
-                        column += 1
-                        item = QTableWidgetItem(str(categories[subject][category][field]))
-                        item.setFlags(Qt.ItemIsEnabled)
-                        item.setTextAlignment(Qt.AlignRight|Qt.AlignVCenter)
-                        self.tb.twTB.setItem(self.tb.twTB.rowCount() - 1, column , item)
-
-
-
-        self.tb.twTB.resizeColumnsToContents()
-
-        self.tb.show()
 
 
 
@@ -4817,6 +4961,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         totalMediaLength, totalMediaLength1, totalMediaLength2 = Decimal("0.0"), Decimal("0.0"), Decimal("0.0")
 
+        # analyse in parallel the media files without length (results are cached)
+        media_lengths = self.pj[OBSERVATIONS][obsId].get("media_info", {}).get("length", {})
+        media_analysis_batch(self.ffmpeg_bin, [mediaFile for player in [PLAYER1, PLAYER2] for mediaFile in self.pj[OBSERVATIONS][obsId][FILE][player]
+                                               if mediaFile not in media_lengths])
+
         for mediaFile in self.pj[OBSERVATIONS][obsId][FILE][PLAYER1]:
             mediaLength = 0
             try:
@@ -5151,7 +5300,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
                 if plot_parameters["include modifiers"]:
 
-                    cursor.execute( "SELECT distinct modifiers FROM events WHERE subject = ? AND code = ?", (subject, behavior) )
+                    cursor.execute("SELECT modifiers FROM events WHERE subject = ? AND code = ? GROUP BY modifiers ORDER BY min(rowid)", (subject, behavior))
                     distinct_modifiers = list(cursor.fetchall())
 
                     for modifier in distinct_modifiers:
@@ -5223,21 +5372,6 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             QMessageBox.warning(self, programName, "Check events")
 
 
-    def convert_time_to_decimal(self, pj):
-        """
-        convert time from float to decimal
-        """
-
-        for obsId in pj[OBSERVATIONS]:
-            if "time offset" in pj[OBSERVATIONS][obsId]:
-                pj[OBSERVATIONS][obsId]["time offset"] = Decimal(str(pj[OBSERVATIONS][obsId]["time offset"]) )
-
-            for idx, event in enumerate(pj[OBSERVATIONS][obsId][EVENTS]):
-                pj[OBSERVATIONS][obsId][EVENTS][idx][pj_obs_fields["time"]] = Decimal(str(pj[OBSERVATIONS][obsId][EVENTS][idx][pj_obs_fields["time"]]))
-
-        return pj
-
-
     def open_project_json(self, projectFileName):
         """
         open project json
@@ -5248,19 +5382,22 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             QMessageBox.warning(self, programName, "File not found")
             return
 
-        s = open(projectFileName, "r").read()
+        if project_file.file_compression(projectFileName) == project_file.ZSTD and not project_file.FLAG_ZSTD_INSTALLED:
+            QMessageBox.critical(self, programName, "This project file is compressed with zstd.<br>The zstandard Python module must be installed to open it")
+            return
 
+        # times of events are converted to decimal when the observation is opened or analyzed
         try:
-            self.pj = json.loads(s)
+            if project_db.is_project_db(projectFileName):
+                self.pj, self.projectCompression, self.projectStorage = project_db.read_project(projectFileName), None, project_db.SQLITE
+            else:
+                (self.pj, self.projectCompression), self.projectStorage = project_file.read_project(projectFileName), None
         except:
             QMessageBox.critical(self, programName, "This project file seems corrupted")
             return
 
         self.projectChanged = False
 
-        # transform time to decimal
-        self.pj = self.convert_time_to_decimal(self.pj)
-
         # add coding_map key to old project files
         if not "coding_map" in self.pj:
             self.pj["coding_map"] = {}
@@ -5372,12 +5509,18 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # if one file is present in player #1 -> set "media_info" key with value of media_file_info
         project_updated = False
 
+        # analysis of media files without media_info (in parallel, results are cached)
+        media_analysis = media_analysis_batch(self.ffmpeg_bin, [media_file_path for obs in self.pj[OBSERVATIONS]
+                                                                if self.pj[OBSERVATIONS][obs][TYPE] in [MEDIA] and "media_info" not in self.pj[OBSERVATIONS][obs]
+                                                                for player in [PLAYER1, PLAYER2]
+                                                                for media_file_path in self.pj[OBSERVATIONS][obs]["file"][player]])
+
         for obs in self.pj[OBSERVATIONS]:
             if self.pj[OBSERVATIONS][obs][TYPE] in [MEDIA] and "media_info" not in self.pj[OBSERVATIONS][obs]:
                 self.pj[OBSERVATIONS][obs]['media_info'] = {"length": {}, "fps": {}, "hasVideo": {}, "hasAudio": {}}
                 for player in [PLAYER1, PLAYER2]:
                     for media_file_path in self.pj[OBSERVATIONS][obs]["file"][player]:
-                        nframe, videoTime, videoDuration, fps, hasVideo, hasAudio = accurate_media_analysis(self.ffmpeg_bin, media_file_path)
+                        nframe, videoTime, videoDuration, fps, hasVideo, hasAudio = media_analysis[media_file_path]
                         #print(media_file_path, nframe, videoTime, videoDuration, fps, hasVideo, hasAudio)
                         if videoDuration:
                             self.pj[OBSERVATIONS][obs]['media_info']["length"][media_file_path] = videoDuration
@@ -5428,6 +5571,15 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         if project_updated:
             QMessageBox.information(self, programName, "The media files information was updated to the new project format.")
 
+        # events modified after the last save (crash)
+        if projectFileName and os.path.isfile(project_file.journal_file_name(projectFileName)):
+            if dialog.MessageDialog(programName, ("The events of the project were modified after the last save.<br>"
+                                                  "Recover the modifications?"), [YES, NO]) == YES:
+                if project_file.replay_journal(self.pj, projectFileName):
+                    self.projectChanged = True
+            else:
+                os.remove(project_file.journal_file_name(projectFileName))
+
 
 
 
@@ -5482,6 +5634,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         """
         logging.info("initialize new project...")
 
+        self.ethogramIndex = None
+
         self.lbLogoUnito.setVisible(False)
         self.lbLogoBoris.setVisible(False)
 
@@ -5509,6 +5663,9 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 if self.save_project_activated() == "not saved":
                     return
 
+            if response == DISCARD:
+                self.discard_journal(self.projectFileName)
+
             if response == CANCEL:
                 return
 
@@ -5570,7 +5727,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             # empty main window tables
             self.twEthogram.setRowCount(0)   # behaviors
             self.twSubjects.setRowCount(0)
-            self.twEvents.setRowCount(0)
+            self.eventsModel.set_events(None)
 
         newProjectWindow = projectDialog(logging.getLogger().getEffectiveLevel())
 
@@ -5753,6 +5910,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
             if mode == NEW:
                 self.projectFileName = ""
+                self.projectCompression, self.projectStorage = None, None
                 self.projectChanged = True
 
             if mode == EDIT:
@@ -5761,6 +5919,9 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             # retrieve project dict from window
             self.pj = dict(newProjectWindow.pj)
 
+            # ethogram lookup tables must be rebuilt
+            self.ethogramIndex = None
+
             self.project = True
 
             '''
@@ -5819,10 +5980,14 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         self.pj["project_format_version"] = project_format_version
 
+        # a running automatic backup must not overwrite this save
+        self.wait_automatic_backup()
+        self.autosaveJournalPosition = None
+
         try:
-            f = open(projectFileName, "w")
-            f.write(json.dumps(self.pj, indent=1, separators=(',', ':'), default=decimal_default))
-            f.close()
+            self.project_writer(projectFileName)()
+
+            self.discard_journal(projectFileName)
 
             self.projectChanged = False
             return ""
@@ -5837,20 +6002,30 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         """
         save current project asking for a new file name
         """
+        compression_filters = project_file.compression_filters()
+        filters = ";;".join(["Projects file (*.boris)"] + list(compression_filters) + ["SQLite projects file (*.boris)", "All files (*)"])
         if QT_VERSION_STR[0] == "4":
-            projectNewFileName, filtr = QFileDialog(self).getSaveFileNameAndFilter(self, "Save project as", os.path.dirname(self.projectFileName), "Projects file (*.boris);;All files (*)")
+            projectNewFileName, filtr = QFileDialog(self).getSaveFileNameAndFilter(self, "Save project as", os.path.dirname(self.projectFileName), filters)
         else:
-            projectNewFileName, filtr = QFileDialog(self).getSaveFileName(self, "Save project as", os.path.dirname(self.projectFileName), "Projects file (*.boris);;All files (*)")
+            projectNewFileName, filtr = QFileDialog(self).getSaveFileName(self, "Save project as", os.path.dirname(self.projectFileName), filters)
         if not projectNewFileName:
             return "Not saved"
         else:
 
             # add .boris if filter = 'Projects file (*.boris)'
-            if  filtr == "Projects file (*.boris)" and os.path.splitext(projectNewFileName)[1] != ".boris":
+            if (filtr in ["Projects file (*.boris)", "SQLite projects file (*.boris)"] or filtr in compression_filters) and os.path.splitext(projectNewFileName)[1] != ".boris":
                 projectNewFileName += ".boris"
 
+            if filtr == "Projects file (*.boris)":
+                self.projectCompression, self.projectStorage = None, None
+            if filtr in compression_filters:
+                self.projectCompression, self.projectStorage = compression_filters[filtr], None
+            if filtr == "SQLite projects file (*.boris)":
+                self.projectCompression, self.projectStorage = None, project_db.SQLITE
+
             self.save_project_json(projectNewFileName)
             self.projectFileName = projectNewFileName
+            self.attach_journal()
 
 
     def save_project_activated(self):
@@ -5894,33 +6069,19 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.lbTimeLive.setText(self.convertTime(currentTime))
 
         # extract State events
-        StateBehaviorsCodes = [self.pj[ETHOGRAM][x]['code'] for x in [y for y in self.pj[ETHOGRAM] if 'State' in self.pj[ETHOGRAM][y][TYPE]]]
+        StateBehaviorsCodes = self.ethogram_index().state_codes
 
         self.currentStates = {}
         # add states for no focal subject
 
         # TODO: replace with function (see timerout)
 
+        # states for all configured subjects and for "no focal subject"
         self.currentStates = self.get_current_states_by_subject(StateBehaviorsCodes,
-                                                                self.pj[OBSERVATIONS][self.observationId][EVENTS],
+                                                                self.obs_events(self.observationId),
                                                                 dict(self.pj[SUBJECTS], **{"": {"name": ""}}),
                                                                 currentTime)
 
-        '''
-        self.currentStates[""] = []
-        for sbc in StateBehaviorsCodes:
-            if len([x[pj_obs_fields['code']] for x in self.pj[OBSERVATIONS][self.observationId][EVENTS ] if x[ pj_obs_fields['subject'] ] == '' and x[ pj_obs_fields['code'] ] == sbc and x[ pj_obs_fields['time'] ] <= currentTime  ] ) % 2: # test if odd
-                self.currentStates[''].append(sbc)
-        '''
-
-        # add states for all configured subjects
-        for idx in self.pj[SUBJECTS]:
-            # add subject index
-            self.currentStates[idx] = []
-            for sbc in StateBehaviorsCodes:
-                if len([x[pj_obs_fields['code']] for x in self.pj[OBSERVATIONS][self.observationId][EVENTS ] if x[ pj_obs_fields['subject']] == self.pj[SUBJECTS][idx]['name'] and x[ pj_obs_fields['code'] ] == sbc and x[ pj_obs_fields['time'] ] <= currentTime  ] ) % 2: # test if odd
-                    self.currentStates[idx].append(sbc)
-
         # show current states
         if self.currentSubject:
             # get index of focal subject (by name)
@@ -5961,11 +6122,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         if not self.liveObservationStarted:
 
-            if self.twEvents.rowCount():
+            if self.eventsModel.rowCount():
 
                 if dialog.MessageDialog(programName, "Delete the current events?", [YES, NO]) == YES:
-                    self.twEvents.setRowCount(0)
-                    self.pj[OBSERVATIONS][self.observationId][EVENTS] = []
+                    self.eventsModel.set_events(None)
+                    self.obs_events(self.observationId).clear()
                 self.projectChanged = True
             self.textButton.setText("Stop live observation")
             self.liveStartTime = QTime()
@@ -6518,7 +6679,25 @@ item []:
 
                 out += "File size: {} Mb<br>".format(round(os.stat(media_file_path).st_size / 1024 / 1024, 1))
 
-                ffmpeg_output = subprocess.getoutput('"{}" -i "{}"'.format(ffmpeg_bin, media_file_path)).split("Stream #0")
+                info = media_info(self.ffmpeg_bin, media_file_path)
+                if info is not None:
+                    out += "Format: {}<br>".format(info["format"].get("format_long_name", info["format"].get("format_name", "")))
+                    out += "Duration: {} s<br>".format(round(info["duration"], 3))
+                    out += "Start time: {} s<br>".format(info["start_time"])
+                    if info["hasVideo"]:
+                        out += "Frame rate: {} ({} fps)<br>".format(info["fps"], round(float(info["fps"]), 3))
+                        out += "Number of frames: {}<br>".format(info["nframe"])
+                    for stream in info["streams"]:
+                        out += "<br>Stream #{}: {} {}".format(stream.get("index"), stream.get("codec_type", ""), stream.get("codec_name", ""))
+                        if stream.get("codec_type") == "video":
+                            out += " {}x{} {}".format(stream.get("width"), stream.get("height"), stream.get("pix_fmt", ""))
+                        if stream.get("codec_type") == "audio":
+                            out += " {} Hz {} channel(s)".format(stream.get("sample_rate"), stream.get("channels"))
+                        if "bit_rate" in stream:
+                            out += " {} kb/s".format(int(stream["bit_rate"]) // 1000)
+                    return out + "<br><br>"
+
+                ffmpeg_output = subprocess.getoutput('"{}" -i "{}"'.format(self.ffmpeg_bin, media_file_path)).split("Stream #0")
                 if len(ffmpeg_output) > 1:
                     out += "{}<br>".format(ffmpeg_output[1])
                 if len(ffmpeg_output) > 2:
@@ -6632,6 +6811,7 @@ item []:
             self.FFmpegTimer.stop()
 
             logging.info("ffmpeg timer stopped")
+            self.close_frame_decoders()
 
             # set thread for cleaning temp directory
             if self.ffmpeg_cache_dir_max_size:
@@ -6676,9 +6856,9 @@ item []:
             else:
                 self.imageDirectory = self.ffmpeg_cache_dir
 
-            # load list of images in a set
-            if not self.imagesList:
-                self.imagesList.update([f.replace(self.imageDirectory + os.sep, "").split("_")[0] for f in glob.glob(self.imageDirectory + os.sep + "BORIS@*")])
+            # index of images extracted in directory
+            if self.imageCacheIndex is None or self.imageCacheIndex.directory != self.imageDirectory:
+                self.imageCacheIndex = image_cache.ImageCacheIndex(self.imageDirectory)
 
             # show frame-by_frame tab
             self.toolBox.setCurrentIndex(1)
@@ -6710,6 +6890,7 @@ item []:
                 self.cleaningThread.exiting = False
                 self.cleaningThread.ffmpeg_cache_dir_max_size = self.ffmpeg_cache_dir_max_size * 1024 * 1024
                 self.cleaningThread.tempdir = self.imageDirectory + os.sep
+                self.cleaningThread.index = self.imageCacheIndex
                 self.cleaningThread.start()
 
 
@@ -6961,7 +7142,7 @@ item []:
             self.no_observation()
             return
 
-        if self.twEvents.selectedItems():
+        if self.twEvents.selectionModel().selectedIndexes():
 
             editWindow = DlgEditEvent(logging.getLogger().getEffectiveLevel())
             editWindow.setWindowTitle("Edit event parameters")
@@ -6970,7 +7151,7 @@ item []:
             editWindow.pj = self.pj
             editWindow.currentModifier = ""
 
-            row = self.twEvents.selectedItems()[0].row()
+            row = self.twEvents.selectionModel().selectedIndexes()[0].row()
 
             if self.timeFormat == HHMMSS:
                 editWindow.dsbTime.setVisible(False)
@@ -7144,41 +7325,59 @@ item []:
         get events current row corresponding to video/frame-by-frame position
         paint twEvents with tracking cursor
         scroll to corresponding event
+
+        the row is found by binary search in the event times
+        the events table is repainted only if the row changed
         """
 
         global ROW
 
-        if self.pj[OBSERVATIONS][self.observationId][EVENTS]:
+        events = self.obs_events(self.observationId)
+        if events:
             ct = self.getLaps()
-            if ct >= self.pj[OBSERVATIONS][self.observationId][EVENTS][-1][0]:
-                ROW = len( self.pj[OBSERVATIONS][self.observationId][EVENTS] )
+            if ct >= events[-1][EVENT_TIME_FIELD_IDX]:
+                row = len(events)
             else:
-                cr_list =  [idx for idx, x in enumerate(self.pj[OBSERVATIONS][self.observationId][EVENTS][:-1]) if x[0] <= ct and self.pj[OBSERVATIONS][self.observationId][EVENTS][idx+1][0] > ct ]
+                # number of events before current time
+                row = events.row_at(ct)
+                if not row:
+                    row = -1
+                elif self.trackingCursorAboveEvent:
+                    row -= 1
 
-                if cr_list:
-                    ROW = cr_list[0]
-                    if not self.trackingCursorAboveEvent:
-                        ROW +=  1
-                else:
-                    ROW = -1
+            if row != ROW:
+                ROW = row
+                self.twEvents.viewport().update()
+                self.twEvents.scrollTo(self.eventsModel.index(ROW, 0))
+
+
+    def current_state_tracker(self):
+        """
+        return the state tracker of the current observation
+        """
+        events = self.obs_events(self.observationId)
+        if self.stateTracker is None or self.stateTracker.events is not events:
+            if self.stateTracker:
+                self.stateTracker.detach()
+            self.stateTracker = event_store.StateTracker(events)
+        return self.stateTracker
 
-            self.twEvents.setItemDelegate(StyledItemDelegateTriangle(self.twEvents))
-            self.twEvents.scrollToItem(self.twEvents.item(ROW, 0))
 
     def get_current_states_by_subject(self, stateBehaviorsCodes, events, subjects, time):
         """
         get current states for subjects at given time
+        events: EventStore of observation
 
+        the state tracker is used for the current observation
         """
+        if events is self.obs_events(self.observationId):
+            tracker = self.current_state_tracker()
+            tracker.seek(time)
+            return tracker.current_states(stateBehaviorsCodes, subjects)
+
         currentStates = {}
         for idx in subjects:
-            currentStates[idx] = []
-            for sbc in stateBehaviorsCodes:
-                if len([x[ EVENT_BEHAVIOR_FIELD_IDX ] for x in events
-                                                       if x[EVENT_SUBJECT_FIELD_IDX] == subjects[idx]["name"]
-                                                          and x[EVENT_BEHAVIOR_FIELD_IDX] == sbc
-                                                          and x[EVENT_TIME_FIELD_IDX] <= time]) % 2: # test if odd
-                    currentStates[idx].append(sbc)
+            currentStates[idx] = [sbc for sbc in stateBehaviorsCodes if events.is_open(subjects[idx]["name"], sbc, time)]
         return currentStates
 
 
@@ -7266,13 +7465,14 @@ item []:
                 # current state(s)
 
                 # extract State events
-                StateBehaviorsCodes = [self.pj[ETHOGRAM][x]["code"] for x in [y for y in self.pj[ETHOGRAM] if STATE in self.pj[ETHOGRAM][y][TYPE].upper()]]
+                StateBehaviorsCodes = self.ethogram_index().state_codes
 
                 self.currentStates = {}
 
                 # add current states for all subject and for "no focal subject"
 
-                self.currentStates = self.get_current_states_by_subject(StateBehaviorsCodes, self.pj[OBSERVATIONS][self.observationId][EVENTS], dict(self.pj[SUBJECTS], **{"": {"name": ""}}), currentTimeOffset)
+                events = self.obs_events(self.observationId)
+                self.currentStates = self.get_current_states_by_subject(StateBehaviorsCodes, events, dict(self.pj[SUBJECTS], **{"": {"name": ""}}), currentTimeOffset)
 
                 # show current subject
                 cm = {}
@@ -7285,12 +7485,7 @@ item []:
                 # show current state(s)
                 txt = []
                 for cs in self.currentStates[idx]:
-                    for ev in self.pj[OBSERVATIONS][self.observationId][EVENTS]:
-                        if ev[EVENT_TIME_FIELD_IDX] > currentTimeOffset:
-                            break
-                        if ev[EVENT_SUBJECT_FIELD_IDX] == self.currentSubject:
-                            if ev[EVENT_BEHAVIOR_FIELD_IDX] == cs:
-                                cm[cs] = ev[EVENT_MODIFIER_FIELD_IDX]
+                    cm[cs] = events.current_modifier(self.currentSubject, cs, currentTimeOffset)
                     # state and modifiers (if any)
                     txt.append(cs + " ({}) ".format(cm[cs])*(cm[cs] != ""))
 
@@ -7343,14 +7538,7 @@ item []:
 
                         for behav in self.currentStates[subjIdx]:
 
-                            cm = ""
-                            for ev in self.pj[OBSERVATIONS][self.observationId][EVENTS]:
-                                if ev[EVENT_TIME_FIELD_IDX] > currentTime / 1000:  # time
-                                    break
-
-                                if ev[EVENT_SUBJECT_FIELD_IDX] == subjName:  # current subject name
-                                    if ev[EVENT_BEHAVIOR_FIELD_IDX] == behav:   # code
-                                        cm = ev[EVENT_MODIFIER_FIELD_IDX]
+                            cm = self.obs_events(self.observationId).current_modifier(subjName, behav, currentTime / 1000)
 
                             #self.pj[OBSERVATIONS][self.observationId][EVENTS].append([currentTime / 1000 - Decimal('0.001'), subjName, behav, cm, ''] )
 
@@ -7411,78 +7599,22 @@ item []:
 
 
 
-    def update_events_start_stop(self):
-        """
-        update status start/stop of events in Events table
-        take consideration of subject and modifiers
-
-        do not return value
-        """
-
-        stateEventsList = [self.pj[ETHOGRAM][x][BEHAVIOR_CODE] for x in self.pj[ETHOGRAM] if STATE in self.pj[ETHOGRAM][x][TYPE].upper()]
-
-        for row in range(0, self.twEvents.rowCount()):
-
-            t = self.twEvents.item(row, tw_obs_fields["time"]).text()
-
-            if ":" in t:
-                time = time2seconds(t)
-            else:
-                time = Decimal(t)
-
-            subject = self.twEvents.item(row, tw_obs_fields["subject"]).text()
-            code = self.twEvents.item(row, tw_obs_fields["code"]).text()
-            modifier = self.twEvents.item(row, tw_obs_fields["modifier"]).text()
-
-            # check if code is state
-            if code in stateEventsList:
-                # how many code before with same subject?
-                nbEvents = len([event[EVENT_BEHAVIOR_FIELD_IDX] for event in self.pj[OBSERVATIONS][self.observationId][EVENTS]
-                                                                  if event[EVENT_BEHAVIOR_FIELD_IDX] == code
-                                                                     and event[EVENT_TIME_FIELD_IDX] < time
-                                                                     and event[EVENT_SUBJECT_FIELD_IDX] == subject
-                                                                     and event[EVENT_MODIFIER_FIELD_IDX] == modifier])
-
-                if nbEvents and (nbEvents % 2): # test >0 and  odd
-                    self.twEvents.item(row, tw_obs_fields[TYPE]).setText(STOP)
-                else:
-                    self.twEvents.item(row, tw_obs_fields[TYPE]).setText(START)
-
-
     def update_events_start_stop2(self, events):
         """
         returns events with status (START/STOP or POINT)
-        take consideration of subject
-        """
-
-        stateEventsList = [self.pj[ETHOGRAM][x][BEHAVIOR_CODE] for x in self.pj[ETHOGRAM] if STATE in self.pj[ETHOGRAM][x][TYPE].upper()]
-        eventsFlagged = []
-        for event in events:
-            time, subject, code, modifier = event[EVENT_TIME_FIELD_IDX], event[EVENT_SUBJECT_FIELD_IDX], event[EVENT_BEHAVIOR_FIELD_IDX], event[EVENT_MODIFIER_FIELD_IDX]
-            # check if code is state
-            if code in stateEventsList:
-                # how many code before with same subject?
-                if len([x[EVENT_BEHAVIOR_FIELD_IDX] for x in events
-                                                     if x[EVENT_BEHAVIOR_FIELD_IDX] == code
-                                                        and x[EVENT_TIME_FIELD_IDX] < time
-                                                        and x[EVENT_SUBJECT_FIELD_IDX] == subject
-                                                        and x[EVENT_MODIFIER_FIELD_IDX] == modifier]) % 2: # test if odd
-                    flag = STOP
-                else:
-                    flag = START
-            else:
-                flag = POINT
+        take consideration of subject and modifiers
+        """
 
-            eventsFlagged.append(event + [flag])
+        stateEventsList = self.ethogram_index().state_codes
 
-        return eventsFlagged
+        return event_store.annotate_start_stop(events, stateEventsList)
 
 
     def checkSameEvent(self, obsId, time, subject, code ):
         """
         check if a same event is already in events list (time, subject, code)
         """
-        return [time, subject, code] in [[x[EVENT_TIME_FIELD_IDX], x[EVENT_SUBJECT_FIELD_IDX], x[EVENT_BEHAVIOR_FIELD_IDX]] for x in self.pj[OBSERVATIONS][obsId][EVENTS]]
+        return self.obs_events(obsId).exists(time, subject, code)
 
 
     def writeEvent(self, event, memTime):
@@ -7490,7 +7622,7 @@ item []:
         add event from pressed key to observation
         offset is added to event time
         ask for modifiers if configured
-        load events in tableview
+        insert event at its ordered position in events (the events table is updated by the event store)
         scroll to active event
         """
 
@@ -7499,6 +7631,12 @@ item []:
         if event is None:
             return
 
+        events = self.obs_events(self.observationId)
+
+        # events table must show the events of the current observation
+        if self.eventsModel.events is not events:
+            self.loadEventsInTW(self.observationId)
+
         # add time offset if not from editing
         if "row" not in event:
             memTime += Decimal(self.pj[OBSERVATIONS][self.observationId][TIME_OFFSET]).quantize(Decimal(".001"))
@@ -7568,9 +7706,9 @@ item []:
         if "row" not in event: # no editing
             if self.currentSubject:
                 csj = []
-                for idx in self.currentStates:
-                    if idx in self.pj[SUBJECTS] and self.pj[SUBJECTS][idx]["name"] == self.currentSubject:
-                        csj = self.currentStates[idx]
+                for idx in self.pj[SUBJECTS]:
+                    if self.pj[SUBJECTS][idx]["name"] == self.currentSubject:
+                        csj = self.currentStates.get(idx, [])
                         break
 
             else:  # no focal subject
@@ -7579,15 +7717,8 @@ item []:
                 except:
                     csj = []
 
-            cm = {} # modifiers for current behaviors
-            for cs in csj:
-                for ev in self.pj[OBSERVATIONS][self.observationId][EVENTS]:
-                    if ev[EVENT_TIME_FIELD_IDX] > memTime:
-                        break
-
-                    if ev[EVENT_SUBJECT_FIELD_IDX] == self.currentSubject:
-                        if ev[EVENT_BEHAVIOR_FIELD_IDX] == cs:
-                            cm[cs] = ev[EVENT_MODIFIER_FIELD_IDX]
+            # modifiers for current behaviors (from the (subject, behavior) index)
+            cm = {cs: events.current_modifier(self.currentSubject, cs, memTime) for cs in csj}
 
             '''
             print("csj",csj)
@@ -7606,7 +7737,7 @@ item []:
 
                 if (event["excluded"] and cs in event["excluded"].split(",")) or (event["code"] == cs and cm[cs] != modifier_str):
                     # add excluded state event to observations (= STOP them)
-                    self.pj[OBSERVATIONS][self.observationId][EVENTS].append([memTime - Decimal("0.001"), self.currentSubject, cs, cm[cs], ""])
+                    events.add([memTime - Decimal("0.001"), self.currentSubject, cs, cm[cs], ""])
 
 
         # remove key code from modifiers
@@ -7622,24 +7753,18 @@ item []:
         else:
             subject = self.currentSubject
 
-        # add event to pj
+        # add event to pj (ordered insertion, events are kept sorted by the event store)
         if "row" in event:
-            self.pj[OBSERVATIONS][self.observationId][EVENTS][event["row"]] = [memTime, subject, event["code"], modifier_str, comment]
+            row = events.replace(event["row"], [memTime, subject, event["code"], modifier_str, comment])
         else:
-            self.pj[OBSERVATIONS][self.observationId][EVENTS].append([memTime, subject, event["code"], modifier_str, comment])
-
-        # sort events in pj
-        self.pj[OBSERVATIONS][self.observationId][EVENTS].sort()
+            row = events.add([memTime, subject, event["code"], modifier_str, comment])
 
-        # reload all events in tw
-        self.loadEventsInTW(self.observationId)
-
-        item = self.twEvents.item([i for i, t in enumerate( self.pj[OBSERVATIONS][self.observationId][EVENTS]) if t[0] == memTime][0], 0)
-
-        self.twEvents.scrollToItem(item)
+        # the events table is updated by the event store
+        self.twEvents.scrollTo(self.eventsModel.index(row, 0))
 
         self.projectChanged = True
 
+        return row
 
 
 
@@ -7651,14 +7776,12 @@ item []:
 
         # check if key duplicated
         items = []
-        for idx in self.pj[ETHOGRAM]:
-            if self.pj[ETHOGRAM][idx]["key"] == obs_key:
-
-                code_descr = self.pj[ETHOGRAM][idx]["code"]
-                if  self.pj[ETHOGRAM][idx]["description"]:
-                    code_descr += " - " + self.pj[ETHOGRAM][idx]["description"]
-                items.append(code_descr)
-                self.detailedObs[code_descr] = idx
+        for idx in self.ethogram_index().behaviors_by_key(obs_key):
+            code_descr = self.pj[ETHOGRAM][idx]["code"]
+            if  self.pj[ETHOGRAM][idx]["description"]:
+                code_descr += " - " + self.pj[ETHOGRAM][idx]["description"]
+            items.append(code_descr)
+            self.detailedObs[code_descr] = idx
 
         items.sort()
 
@@ -7904,7 +8027,7 @@ item []:
 
         # check if key is function key
         if (ek in function_keys):
-            if function_keys[ek] in [self.pj[ETHOGRAM][x]["key"] for x in self.pj[ETHOGRAM]]:
+            if self.ethogram_index().behaviors_by_key(function_keys[ek]):
                 obs_key = function_keys[ek]
 
         # get video time
@@ -7936,16 +8059,12 @@ item []:
 
             if ek == Qt.Key_Enter and event.text():
                 ek_unichr = ""
-                for o in self.pj[ETHOGRAM]:
-                    if self.pj[ETHOGRAM][o]["code"] == event.text():
-                        obs_idx = o
-                        count += 1
+                behaviors = self.ethogram_index().behaviors_by_code(event.text())
             else:
                 # count key occurence in ethogram
-                for o in self.pj[ETHOGRAM]:
-                    if self.pj[ETHOGRAM][o]["key"] == ek_unichr:
-                        obs_idx = o
-                        count += 1
+                behaviors = self.ethogram_index().behaviors_by_key(ek_unichr)
+            if behaviors:
+                obs_idx, count = behaviors[-1], len(behaviors)
 
             # check if key defines a suject
             flag_subject = False
@@ -8034,14 +8153,11 @@ item []:
         substract time offset if any
         """
 
-        if self.twEvents.selectedIndexes():
+        if self.twEvents.selectionModel().selectedIndexes():
 
-            row = self.twEvents.selectedIndexes()[0].row()
+            row = self.twEvents.selectionModel().selectedIndexes()[0].row()
 
-            if ':' in self.twEvents.item(row, 0).text():
-                time_ = time2seconds(  self.twEvents.item(row, 0).text()  )
-            else:
-                time_  = Decimal( self.twEvents.item(row, 0).text() )
+            time_ = self.obs_events(self.observationId)[row][EVENT_TIME_FIELD_IDX]
 
             # substract time offset
             time_ -= self.pj[OBSERVATIONS][self.observationId][TIME_OFFSET]
@@ -8147,7 +8263,7 @@ item []:
             return timeSeconds
 
 
-        if self.twEvents.rowCount():
+        if self.eventsModel.rowCount():
             text, ok = QInputDialog.getText(self, "Select events in time interval", "Interval: (example: 12.5-14.7 or 02:45.780-03:15.120 )", QLineEdit.Normal, "")
 
             if ok and text != '':
@@ -8173,12 +8289,8 @@ item []:
                     return
                 self.twEvents.clearSelection()
                 self.twEvents.setSelectionMode( QAbstractItemView.MultiSelection )
-                for r in range(0, self.twEvents.rowCount()):
-                    if ':' in self.twEvents.item(r, 0).text():
-                        time = time2seconds(self.twEvents.item(r, 0).text())
-                    else:
-                        time = Decimal(self.twEvents.item(r, 0).text())
-                    if from_sec <= time <= to_sec:
+                for r, event in enumerate(self.obs_events(self.observationId)):
+                    if from_sec <= event[EVENT_TIME_FIELD_IDX] <= to_sec:
                         self.twEvents.selectRow(r)
 
         else:
@@ -8198,9 +8310,8 @@ item []:
             return
 
         if dialog.MessageDialog(programName, "Do you really want to delete all events from the current observation?", [YES, NO]) == YES:
-            self.pj[OBSERVATIONS][self.observationId][EVENTS] = []
+            self.obs_events(self.observationId).clear()
             self.projectChanged = True
-            self.loadEventsInTW(self.observationId)
 
 
     def delete_selected_events(self):
@@ -8212,14 +8323,13 @@ item []:
             self.no_observation()
             return
 
-        if not self.twEvents.selectedIndexes():
+        if not self.twEvents.selectionModel().selectedIndexes():
             QMessageBox.warning(self, programName, "No event selected!")
         else:
             # list of rows to delete (set for unique)
-            rows = set([item.row() for item in self.twEvents.selectedIndexes()])
-            self.pj[OBSERVATIONS][self.observationId][EVENTS] = [event for idx, event in enumerate(self.pj[OBSERVATIONS][self.observationId][EVENTS]) if not idx in rows]
+            rows = set([item.row() for item in self.twEvents.selectionModel().selectedIndexes()])
+            self.obs_events(self.observationId).delete_rows(rows)
             self.projectChanged = True
-            self.loadEventsInTW( self.observationId )
 
 
     def edit_selected_events(self):
@@ -8227,7 +8337,7 @@ item []:
         edit one or more selected events for subject, behavior and/or comment
         """
         # list of rows to edit
-        rowsToEdit = set([item.row() for item in self.twEvents.selectedIndexes()])
+        rowsToEdit = set([item.row() for item in self.twEvents.selectionModel().selectedIndexes()])
 
         if not len(rowsToEdit):
             QMessageBox.warning(self, programName, "No event selected!")
@@ -8239,18 +8349,23 @@ item []:
             dialogWindow.all_subjects = [self.pj[SUBJECTS][str(k)]["name"] for k in sorted([int(x) for x in self.pj[SUBJECTS].keys()])]
 
             if dialogWindow.exec_():
-                for idx, event in enumerate(self.pj[OBSERVATIONS][self.observationId][EVENTS]):
-                    if idx in rowsToEdit:
-                        if dialogWindow.rbSubject.isChecked():
-                            event[EVENT_SUBJECT_FIELD_IDX] = dialogWindow.newText.selectedItems()[0].text()
-                        if dialogWindow.rbBehavior.isChecked():
-                            event[EVENT_BEHAVIOR_FIELD_IDX] = dialogWindow.newText.selectedItems()[0].text()
-                        if dialogWindow.rbComment.isChecked():
-                            event[EVENT_COMMENT_FIELD_IDX] = dialogWindow.commentText.text()
-
-                        self.pj[OBSERVATIONS][self.observationId][EVENTS][idx] = event
-                        self.projectChanged = True
-                self.loadEventsInTW(self.observationId)
+                events = self.obs_events(self.observationId)
+                edited_events = []
+                for idx in rowsToEdit:
+                    event = list(events[idx])
+                    if dialogWindow.rbSubject.isChecked():
+                        event[EVENT_SUBJECT_FIELD_IDX] = dialogWindow.newText.selectedItems()[0].text()
+                    if dialogWindow.rbBehavior.isChecked():
+                        event[EVENT_BEHAVIOR_FIELD_IDX] = dialogWindow.newText.selectedItems()[0].text()
+                    if dialogWindow.rbComment.isChecked():
+                        event[EVENT_COMMENT_FIELD_IDX] = dialogWindow.commentText.text()
+                    edited_events.append(event)
+
+                # edited events can change position in the sorted events
+                events.delete_rows(rowsToEdit)
+                for event in edited_events:
+                    events.add(event)
+                    self.projectChanged = True
 
 
     def click_signal_find_in_events(self, msg):
@@ -8282,7 +8397,7 @@ item []:
                 for idx in fields_list:
                     if self.find_dialog.findText.text() in event[idx]:
                         self.find_dialog.currentIdx = event_idx
-                        self.twEvents.scrollToItem(self.twEvents.item(event_idx, 0))
+                        self.twEvents.scrollTo(self.eventsModel.index(event_idx, 0))
                         self.twEvents.selectRow(event_idx)
                         return
 
@@ -8301,7 +8416,7 @@ item []:
 
         self.find_dialog = dialog.FindInEvents()
         # list of rows to find
-        self.find_dialog.rowsToFind = set([item.row() for item in self.twEvents.selectedIndexes()])
+        self.find_dialog.rowsToFind = set([item.row() for item in self.twEvents.selectionModel().selectedIndexes()])
         self.find_dialog.currentIdx = -1
         self.find_dialog.clickSignal.connect(self.click_signal_find_in_events)
         self.find_dialog.setWindowFlags(Qt.WindowStaysOnTopHint)
@@ -8320,7 +8435,7 @@ item []:
             dialog.MessageDialog(programName, "There is nothing to find.", ["OK"])
             return
 
-        if self.find_replace_dialog.cbFindInSelectedEvents.isChecked() and not len(self.find_replace_dialog.rowsToFind):
+        if self.find_replace_dialog.cbFindInSelectedEvents.isChecked() and not len(self.find_replace_dialog.eventsToFind):
             dialog.MessageDialog(programName, "There are no selected events", ["OK"])
             return
 
@@ -8335,24 +8450,30 @@ item []:
             fields_list.append(EVENT_COMMENT_FIELD_IDX)
 
         number_replacement = 0
-        for event_idx, event in enumerate(self.pj[OBSERVATIONS][self.observationId][EVENTS]):
+        for event_idx, event in enumerate(list(self.obs_events(self.observationId))):
 
             if event_idx < self.find_replace_dialog.currentIdx:
                 continue
 
-            if (not self.find_replace_dialog.cbFindInSelectedEvents.isChecked()) or (self.find_replace_dialog.cbFindInSelectedEvents.isChecked() and event_idx in self.find_replace_dialog.rowsToFind):
+            if (not self.find_replace_dialog.cbFindInSelectedEvents.isChecked()) or (self.find_replace_dialog.cbFindInSelectedEvents.isChecked() and tuple(event) in self.find_replace_dialog.eventsToFind):
                 for idx1 in fields_list:
                     if idx1 <= self.find_replace_dialog.currentIdx_idx:
                         continue
                     if self.find_replace_dialog.findText.text() in event[idx1]:
                         number_replacement += 1
-                        self.find_replace_dialog.currentIdx = event_idx
-                        self.find_replace_dialog.currentIdx_idx = idx1
+                        events = self.obs_events(self.observationId)
+                        row = events.row_of(event)
+                        old_event, event = tuple(event), list(event)
                         event[idx1] = event[idx1].replace(self.find_replace_dialog.findText.text(), self.find_replace_dialog.replaceText.text())
-                        self.pj[OBSERVATIONS][self.observationId][EVENTS][event_idx] = event
-                        self.loadEventsInTW(self.observationId)
-                        self.twEvents.scrollToItem(self.twEvents.item(event_idx, 0))
-                        self.twEvents.selectRow(event_idx)
+                        # the store is re-sorted: follow the event to its new row
+                        new_row = events.replace(row, event)
+                        if old_event in self.find_replace_dialog.eventsToFind:
+                            self.find_replace_dialog.eventsToFind.discard(old_event)
+                            self.find_replace_dialog.eventsToFind.add(tuple(event))
+                        self.find_replace_dialog.currentIdx = new_row
+                        self.find_replace_dialog.currentIdx_idx = idx1
+                        self.twEvents.scrollTo(self.eventsModel.index(new_row, 0))
+                        self.twEvents.selectRow(new_row)
                         self.projectChanged = True
 
                         if msg == "FIND_REPLACE":
@@ -8377,8 +8498,9 @@ item []:
         self.find_replace_dialog = dialog.FindReplaceEvents()
         self.find_replace_dialog.currentIdx = -1
         self.find_replace_dialog.currentIdx_idx = -1
-        # list of rows to find/replace
-        self.find_replace_dialog.rowsToFind = set([item.row() for item in self.twEvents.selectedIndexes()])
+        # events to find/replace (rows are not stable: replaced events are re-sorted)
+        events = self.obs_events(self.observationId)
+        self.find_replace_dialog.eventsToFind = set([tuple(events[row]) for row in set([item.row() for item in self.twEvents.selectionModel().selectedIndexes()])])
         self.find_replace_dialog.clickSignal.connect(self.click_signal_find_replace_in_events)
         self.find_replace_dialog.setWindowFlags(Qt.WindowStaysOnTopHint)
         self.find_replace_dialog.show()
@@ -8914,6 +9036,8 @@ item []:
          and close program
         """
 
+        self.wait_automatic_backup()
+
         # check if re-encoding
         if self.ffmpeg_recode_process:
             QMessageBox.warning(self, programName, "BORIS is re-encoding/resizing a video. Please wait before closing.")
@@ -8926,6 +9050,9 @@ item []:
                 if self.save_project_activated() == "not saved":
                     event.ignore()
 
+            if response == DISCARD:
+                self.discard_journal(self.projectFileName)
+
             if response == CANCEL:
                 event.ignore()
 
@@ -8941,73 +9068,105 @@ item []:
 
     def import_observations(self):
         """
-        import observations from project file
+        import observations from one or more project files
+        the events are converted to Decimal only for the imported observations
+        the same choice is applied to all observations with unknown behaviors/subjects
+        and to all observations already in the current project
         """
 
-        '''
-        if QT_VERSION_STR[0] == "4":
-            fileName = QFileDialog(self).getOpenFileName(self, "Choose a BORIS project file", "", "Project files (*.boris);;Old project files (*.obs);;All files (*)")
-        else:
-            fileName, _ = QFileDialog(self).getOpenFileName(self, "Choose a BORIS project file", "", "Project files (*.boris);;Old project files (*.obs);;All files (*)")
-        '''
-
-        fn =  QFileDialog(self).getOpenFileName(self, "Choose a BORIS project file", "", "Project files (*.boris);;Old project files (*.obs);;All files (*)")
-        fileName = fn[0] if type(fn) is tuple else fn
+        fn = QFileDialog(self).getOpenFileNames(self, "Choose BORIS project files", "", "Project files (*.boris);;Old project files (*.obs);;All files (*)")
+        fileNames = fn[0] if type(fn) is tuple else fn
 
+        if not fileNames:
+            return
 
-        if self.projectFileName and fileName == self.projectFileName:
+        if self.projectFileName and self.projectFileName in fileNames:
             QMessageBox.critical(None, programName, "This project is already open", QMessageBox.Ok | QMessageBox.Default, QMessageBox.NoButton)
             return
 
-        if fileName:
-
+        # label in list: (obsId, observation)
+        observations = {}
+        for fileName in fileNames:
             try:
-                fromProject = json.loads(open(fileName, "r").read())
+                if project_db.is_project_db(fileName):
+                    fromProject = project_db.read_project(fileName)
+                else:
+                    fromProject = project_file.read_project(fileName)[0]
             except:
-                QMessageBox.critical(self, programName, "This project file seems corrupted")
+                QMessageBox.critical(self, programName, "The project file {} seems corrupted".format(fileName))
                 return
 
-            # transform time to decimal
-            fromProject = self.convert_time_to_decimal(fromProject)
+            for obsId in fromProject[OBSERVATIONS]:
+                label = obsId if len(fileNames) == 1 else "{} ({})".format(obsId, os.path.basename(fileName))
+                observations[label] = (obsId, fromProject[OBSERVATIONS][obsId])
 
-            dbc = dialog.ChooseObservationsToImport("Choose the observations to import:", sorted(list(fromProject[OBSERVATIONS].keys())))
+        dbc = dialog.ChooseObservationsToImport("Choose the observations to import:", sorted(list(observations.keys())))
 
-            if dbc.exec_():
-
-                selected_observations = dbc.get_selected_observations()
-                if selected_observations:
-                    flagImported = False
+        if not dbc.exec_():
+            return
 
-                    # set of behaviors in current projet ethogram
-                    behav_set = set([self.pj[ETHOGRAM][idx]["code"] for idx in self.pj[ETHOGRAM]])
+        selected_observations = dbc.get_selected_observations()
+        if not selected_observations:
+            return
 
-                    # set of subjects in current projet
-                    subjects_set = set([self.pj[SUBJECTS][idx]["name"] for idx in self.pj[SUBJECTS]])
+        # set of behaviors in current projet ethogram
+        behav_set = set([self.pj[ETHOGRAM][idx]["code"] for idx in self.pj[ETHOGRAM]])
 
-                    for obsId in selected_observations:
+        # set of subjects in current projet
+        subjects_set = set([self.pj[SUBJECTS][idx]["name"] for idx in self.pj[SUBJECTS]]) | {""}
 
-                        # check if behaviors are in current project ethogram
-                        new_behav_set = set([event[EVENT_BEHAVIOR_FIELD_IDX] for event in fromProject[OBSERVATIONS][obsId][EVENTS] if event[EVENT_BEHAVIOR_FIELD_IDX] not in behav_set])
-                        if new_behav_set:
-                            if dialog.MessageDialog(programName, "Some coded behaviors in <b>{}</b> are not in the ethogram:<br><b>{}</b>".format(obsId, ", ".join(new_behav_set)), ["Skip observation", "Import observation"]) == "Skip observation":
-                                continue
+        # check behaviors and subjects of all selected observations
+        not_compatible = {}
+        for label in selected_observations:
+            behaviors, subjects = project_file.observation_codes(observations[label][1])
+            new_behav_set, new_subject_set = behaviors - behav_set, subjects - subjects_set
+            if new_behav_set or new_subject_set:
+                not_compatible[label] = ", ".join(sorted(new_behav_set | new_subject_set))
 
-                        # check if subjects are in current project
-                        new_subject_set = set([event[EVENT_SUBJECT_FIELD_IDX] for event in fromProject[OBSERVATIONS][obsId][EVENTS] if event[EVENT_SUBJECT_FIELD_IDX] not in subjects_set])
-                        if new_subject_set and new_subject_set != {''}:
-                            if dialog.MessageDialog(programName, "Some coded subjects in <b>{}</b> are not defined in the project:<br><b>{}</b>".format(obsId, ", ".join(new_subject_set)), ["Skip observation", "Import observation"]) == "Skip observation":
-                                continue
-
-                        if obsId in self.pj[OBSERVATIONS].keys():
-                            if dialog.MessageDialog(programName, "The observation <b>{}</b> already exists in the current project.<br>".format(obsId), ["Skip observation", "Rename observation"]) == "Rename observation":
-                                self.pj[OBSERVATIONS]["{} (imported at {})".format(obsId, datetime_iso8601())] = dict(fromProject[OBSERVATIONS][obsId])
-                                flagImported = True
-                        else:
-                            self.pj[OBSERVATIONS][obsId] = dict(fromProject[OBSERVATIONS][obsId])
-                            flagImported = True
+        if not_compatible:
+            response = dialog.MessageDialog(programName, ("Some coded behaviors or subjects are not defined in the current project:<br>{}"
+                                                          .format("<br>".join("<b>{}</b>: {}".format(label, not_compatible[label]) for label in not_compatible))),
+                                            ["Skip these observations", "Import all observations", CANCEL])
+            if response == CANCEL:
+                return
+            if response == "Skip these observations":
+                selected_observations = [label for label in selected_observations if label not in not_compatible]
+
+        already_in_project = [label for label in selected_observations if observations[label][0] in self.pj[OBSERVATIONS]]
+        # observations selected in more than one project file
+        obsIds = [observations[label][0] for label in selected_observations]
+        already_in_project.extend(label for idx, label in enumerate(selected_observations)
+                                  if obsIds[idx] in obsIds[:idx] and label not in already_in_project)
+
+        policy = "Rename observations"
+        if already_in_project:
+            policy = dialog.MessageDialog(programName, ("These observations already exist in the current project:<br><b>{}</b>"
+                                                        .format("<br>".join(already_in_project))),
+                                          ["Skip these observations", "Rename observations", CANCEL])
+            if policy == CANCEL:
+                return
 
-                    if flagImported:
-                        QMessageBox.information(self, programName, "Observations imported successfully")
+        imported_at = datetime_iso8601()
+        flagImported = False
+        for label in selected_observations:
+            obsId, observation = observations[label]
+            if obsId in self.pj[OBSERVATIONS]:
+                if policy == "Skip these observations":
+                    continue
+                newObsId, count = "{} (imported at {})".format(obsId, imported_at), 1
+                while newObsId in self.pj[OBSERVATIONS]:
+                    count += 1
+                    newObsId = "{} (imported at {} #{})".format(obsId, imported_at, count)
+                obsId = newObsId
+            # events must not be read from the source project file after the import
+            if isinstance(observation, project_file.LazyObservation) and project_db.stored_events(observation) is not None:
+                observation.materialize()
+            self.pj[OBSERVATIONS][obsId] = observation
+            flagImported = True
+
+        if flagImported:
+            self.projectChanged = True
+            QMessageBox.information(self, programName, "Observations imported successfully")
 
 
     def play_video(self):
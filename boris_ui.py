@@ -146,7 +146,7 @@ class Ui_MainWindow(object):
         self.verticalLayout_7.setObjectName(_fromUtf8("verticalLayout_7"))
         self.verticalLayout = QtGui.QVBoxLayout()
         self.verticalLayout.setObjectName(_fromUtf8("verticalLayout"))
-        self.twEvents = QtGui.QTableWidget(self.dockWidgetContents_2)
+        self.twEvents = QtGui.QTableView(self.dockWidgetContents_2)
         self.twEvents.setEnabled(True)
         self.twEvents.setFocusPolicy(QtCore.Qt.NoFocus)
         self.twEvents.setAutoScroll(False)
@@ -158,8 +158,6 @@ class Ui_MainWindow(object):
         self.twEvents.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
         self.twEvents.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
         self.twEvents.setObjectName(_fromUtf8("twEvents"))
-        self.twEvents.setColumnCount(0)
-        self.twEvents.setRowCount(0)
         self.verticalLayout.addWidget(self.twEvents)
         self.verticalLayout_7.addLayout(self.verticalLayout)
         self.dwObservations.setWidget(self.dockWidgetContents_2)
@@ -133,7 +133,7 @@ class Ui_MainWindow(object):
         self.verticalLayout_7.setObjectName("verticalLayout_7")
         self.verticalLayout = QtWidgets.QVBoxLayout()
         self.verticalLayout.setObjectName("verticalLayout")
-        self.twEvents = QtWidgets.QTableWidget(self.dockWidgetContents_2)
+        self.twEvents = QtWidgets.QTableView(self.dockWidgetContents_2)
         self.twEvents.setEnabled(True)
         self.twEvents.setFocusPolicy(QtCore.Qt.NoFocus)
         self.twEvents.setAutoScroll(False)
@@ -145,8 +145,6 @@ class Ui_MainWindow(object):
         self.twEvents.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
         self.twEvents.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
         self.twEvents.setObjectName("twEvents")
-        self.twEvents.setColumnCount(0)
-        self.twEvents.setRowCount(0)
         self.verticalLayout.addWidget(self.twEvents)
         self.verticalLayout_7.addLayout(self.verticalLayout)
         self.dwObservations.setWidget(self.dockWidgetContents_2)
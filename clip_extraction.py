@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""
+BORIS
+Behavioral Observation Research Interactive Software
+Copyright 2012-2017 Olivier Friard
+
+This file is part of BORIS.
+
+  BORIS is free software; you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation; either version 3 of the License, or
+  any later version.
+
+  BORIS is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program; if not see <http://www.gnu.org/licenses/>.
+
+"""
+
+import logging
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# number of ffmpeg processes extracting clips at the same time
+MAX_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+
+def clip_command(ffmpeg_bin, mediaFile, start, stop, output, stream_copy=False):
+    """
+    ffmpeg command extracting the clip from start to stop (in seconds) of media file
+    the media file is read from start (input seeking)
+
+    stream_copy: streams are copied without re-encoding (fast)
+    the clip then starts on the keyframe preceding start
+    """
+    command = [ffmpeg_bin, "-y", "-loglevel", "error", "-ss", str(start), "-i", mediaFile, "-t", str(stop - start)]
+    if stream_copy:
+        command.extend(["-c", "copy", "-avoid_negative_ts", "make_zero"])
+    return command + [output]
+
+
+class ClipExtractor(object):
+    """
+    run the ffmpeg commands extracting clips with a pool of threads
+    the extraction can be cancelled from another thread
+    """
+
+    def __init__(self, commands, max_workers=MAX_WORKERS):
+        self.commands = commands
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.cancelled = False
+        self.done = 0
+        self.errors = []
+
+    def _extract(self, command, progress):
+        with self.lock:
+            if self.cancelled:
+                return
+            logging.debug("ffmpeg command: {}".format(command))
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            self.processes.add(process)
+
+        out, error = process.communicate()
+
+        with self.lock:
+            self.processes.discard(process)
+            if process.returncode:
+                if self.cancelled:
+                    # remove incomplete clip
+                    if os.path.isfile(command[-1]):
+                        os.remove(command[-1])
+                    return
+                self.errors.append((command[-1], error.decode("utf-8", "replace").strip()))
+            self.done += 1
+            done = self.done
+
+        if progress is not None:
+            progress(done, len(self.commands))
+
+    def run(self, progress=None):
+        """
+        extract all clips
+        progress: function(number of extracted clips, number of clips) called after each clip
+        return list of (clip file, ffmpeg error) for the clips not extracted
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(lambda command: self._extract(command, progress), self.commands))
+        return self.errors
+
+    def cancel(self):
+        """
+        stop the running ffmpeg processes and skip the clips not yet extracted
+        """
+        with self.lock:
+            self.cancelled = True
+            for process in self.processes:
+                process.kill()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+BORIS
+Behavioral Observation Research Interactive Software
+Copyright 2012-2017 Olivier Friard
+
+This file is part of BORIS.
+
+  BORIS is free software; you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation; either version 3 of the License, or
+  any later version.
+
+  BORIS is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program; if not see <http://www.gnu.org/licenses/>.
+
+"""
+
+from config import *
+
+
+class EthogramIndex(object):
+    """
+    lookup tables of the ethogram (behaviors configuration)
+    must be rebuilt when the ethogram is modified
+    """
+
+    def __init__(self, ethogram):
+        self.ethogram = ethogram
+        self.types = {}            # code -> type of behavior
+        self.by_key = {}           # key -> list of behavior indexes
+        self.by_code = {}          # code -> list of behavior indexes
+        self.state_codes = []      # codes of state behaviors (ethogram order)
+
+        for idx in ethogram:
+            behavior = ethogram[idx]
+            self.types.setdefault(behavior["code"], behavior[TYPE])
+            self.by_key.setdefault(behavior["key"], []).append(idx)
+            self.by_code.setdefault(behavior["code"], []).append(idx)
+            if STATE in behavior[TYPE].upper():
+                self.state_codes.append(behavior["code"])
+
+        self.state_codes_set = set(self.state_codes)
+
+    def event_type(self, code):
+        """
+        type of behavior code (None if code not found)
+        """
+        return self.types.get(code)
+
+    def is_state(self, code):
+        return code in self.state_codes_set
+
+    def behaviors_by_key(self, key):
+        """
+        indexes of behaviors coded by key
+        """
+        return self.by_key.get(key, [])
+
+    def behaviors_by_code(self, code):
+        """
+        indexes of behaviors with code
+        """
+        return self.by_code.get(code, [])
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+
+"""
+BORIS
+Behavioral Observation Research Interactive Software
+Copyright 2012-2017 Olivier Friard
+
+This file is part of BORIS.
+
+  BORIS is free software; you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation; either version 3 of the License, or
+  any later version.
+
+  BORIS is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program; if not see <http://www.gnu.org/licenses/>.
+
+"""
+
+import bisect
+import sys
+from array import array
+from decimal import Decimal
+from operator import itemgetter
+
+from config import *
+
+
+class TimeIndex(object):
+    """
+    sorted times (and associated values) of the events sharing the same key
+    """
+
+    __slots__ = ("times", "values")
+
+    def __init__(self):
+        self.times = []
+        self.values = []
+
+    def insert(self, time, value):
+        idx = bisect.bisect_right(self.times, time)
+        self.times.insert(idx, time)
+        self.values.insert(idx, value)
+
+    def remove(self, time, value):
+        idx = bisect.bisect_left(self.times, time)
+        while idx < len(self.times) and self.times[idx] == time:
+            if self.values[idx] == value:
+                del self.times[idx]
+                del self.values[idx]
+                return
+            idx += 1
+
+    def count(self, time, strict=False):
+        """
+        number of events before time (included if not strict)
+        """
+        if strict:
+            return bisect.bisect_left(self.times, time)
+        return bisect.bisect_right(self.times, time)
+
+    def last_value(self, time, default=""):
+        """
+        value of the last event at or before time
+        """
+        idx = bisect.bisect_right(self.times, time)
+        return self.values[idx - 1] if idx else default
+
+
+class EventStoreListener(object):
+    """
+    base class for the objects notified of the modifications of an event store
+    """
+
+    def event_about_to_be_inserted(self, row, event):
+        pass
+
+    def event_inserted(self, row, event):
+        pass
+
+    def event_about_to_be_removed(self, row, event):
+        pass
+
+    def event_removed(self, row, event):
+        pass
+
+    def events_about_to_be_reset(self):
+        pass
+
+    def events_reset(self):
+        pass
+
+
+class EventStore(list):
+    """
+    events of an observation kept sorted by time and indexed by
+    (subject, behavior) and (subject, behavior, modifier)
+
+    the store is a list of [time, subject, code, modifier, comment] events
+    and is serialized as the usual events list.
+    Events must not be modified in place: use add, replace and delete_rows
+    version is incremented at each modification
+    """
+
+    def __init__(self, events=None):
+        super(EventStore, self).__init__(sorted(events) if events else [])
+        self._listeners = []
+        self.version = 0
+        self._build_indexes()
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def _build_indexes(self):
+        self._times = [event[EVENT_TIME_FIELD_IDX] for event in self]
+        self._by_behavior = {}
+        self._by_modifier = {}
+        # number of events by (time, subject, code) for duplicate detection
+        self._keys = {}
+        for event in self:
+            self._index(event)
+
+    def _index(self, event):
+        time, subject, code, modifier = event[EVENT_TIME_FIELD_IDX], event[EVENT_SUBJECT_FIELD_IDX], event[EVENT_BEHAVIOR_FIELD_IDX], event[EVENT_MODIFIER_FIELD_IDX]
+        self._by_behavior.setdefault((subject, code), TimeIndex()).insert(time, modifier)
+        self._by_modifier.setdefault((subject, code, modifier), TimeIndex()).insert(time, modifier)
+        self._keys[(time, subject, code)] = self._keys.get((time, subject, code), 0) + 1
+
+    def _unindex(self, event):
+        time, subject, code, modifier = event[EVENT_TIME_FIELD_IDX], event[EVENT_SUBJECT_FIELD_IDX], event[EVENT_BEHAVIOR_FIELD_IDX], event[EVENT_MODIFIER_FIELD_IDX]
+        for index, key in [(self._by_behavior, (subject, code)), (self._by_modifier, (subject, code, modifier))]:
+            if key in index:
+                index[key].remove(time, modifier)
+                if not index[key].times:
+                    del index[key]
+        key = (time, subject, code)
+        if self._keys.get(key, 0) > 1:
+            self._keys[key] -= 1
+        else:
+            self._keys.pop(key, None)
+
+    def add_listener(self, listener):
+        """
+        register an object notified of the modifications of the store
+        (see EventStoreListener)
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def add(self, event):
+        """
+        insert event at its ordered position
+        return row of the inserted event
+        """
+        row = bisect.bisect_right(self, event)
+        for listener in self._listeners:
+            listener.event_about_to_be_inserted(row, event)
+        list.insert(self, row, event)
+        self._times.insert(row, event[EVENT_TIME_FIELD_IDX])
+        self._index(event)
+        self.version += 1
+        for listener in self._listeners:
+            listener.event_inserted(row, event)
+        return row
+
+    def replace(self, row, event):
+        """
+        replace event at row
+        return new row of event
+        """
+        self._remove_row(row)
+        return self.add(event)
+
+    def _remove_row(self, row):
+        for listener in self._listeners:
+            listener.event_about_to_be_removed(row, self[row])
+        event = list.pop(self, row)
+        del self._times[row]
+        self._unindex(event)
+        self.version += 1
+        for listener in self._listeners:
+            listener.event_removed(row, event)
+        return event
+
+    def delete_rows(self, rows):
+        """
+        delete events at rows
+        """
+        for row in sorted(set(rows), reverse=True):
+            self._remove_row(row)
+
+    def reset(self, events):
+        """
+        replace all events
+        """
+        for listener in self._listeners:
+            listener.events_about_to_be_reset()
+        list.__init__(self, sorted(events))
+        self._build_indexes()
+        self.version += 1
+        for listener in self._listeners:
+            listener.events_reset()
+
+    def row_of(self, event):
+        """
+        row of event (compared by value) or -1 if not found
+        """
+        row = bisect.bisect_left(self, event)
+        return row if row < len(self) and self[row] == event else -1
+
+    def row_at(self, time):
+        """
+        number of events with time lower or equal to time
+        """
+        return bisect.bisect_right(self._times, time)
+
+    def count_before(self, subject, code, time, modifier=None, strict=False):
+        """
+        number of events of behavior code for subject before time
+        (included if not strict). Restricted to modifier if not None
+        """
+        if modifier is None:
+            index = self._by_behavior.get((subject, code))
+        else:
+            index = self._by_modifier.get((subject, code, modifier))
+        return index.count(time, strict) if index else 0
+
+    def is_open(self, subject, code, time):
+        """
+        True if state behavior code is started for subject at time
+        """
+        return self.count_before(subject, code, time) % 2 == 1
+
+    def current_modifier(self, subject, code, time):
+        """
+        modifier of last event of behavior code for subject at or before time
+        """
+        index = self._by_behavior.get((subject, code))
+        return index.last_value(time) if index else ""
+
+    def exists(self, time, subject, code):
+        """
+        check if an event with same time, subject and code is present
+        """
+        return (time, subject, code) in self._keys
+
+    # list methods are redirected to keep events sorted and indexed
+
+    def append(self, event):
+        self.add(event)
+
+    def insert(self, row, event):
+        """
+        insert event at row (row must be an ordered position of event)
+        """
+        row = row if row >= 0 else max(0, len(self) + row)
+        if (row > 0 and self[row - 1] > event) or (row < len(self) and self[row] < event):
+            raise ValueError("events are kept sorted: event can not be inserted at row {}".format(row))
+        self.add(event)
+
+    def extend(self, events):
+        self.reset(list(self) + list(events))
+
+    def __iadd__(self, events):
+        self.extend(events)
+        return self
+
+    def sort(self, key=None, reverse=False):
+        # events are always sorted
+        if key is not None or reverse:
+            raise ValueError("events are kept sorted by time: the sort order can not be changed")
+
+    def __setitem__(self, row, event):
+        if isinstance(row, slice):
+            events = list(self)
+            events[row] = event
+            self.reset(events)
+        else:
+            self.replace(row if row >= 0 else len(self) + row, event)
+
+    def __delitem__(self, row):
+        if isinstance(row, slice):
+            self.delete_rows(range(len(self))[row])
+        else:
+            self._remove_row(row if row >= 0 else len(self) + row)
+
+    def pop(self, row=-1):
+        return self._remove_row(row if row >= 0 else len(self) + row)
+
+    def remove(self, event):
+        self._remove_row(self.index(event))
+
+    def clear(self):
+        self.reset([])
+
+
+class StateTracker(EventStoreListener):
+    """
+    number of events by (subject, behavior) before a cursor time
+
+    the cursor is moved with seek: only the events between the old and the new
+    position are read. The tracker listens to the event store and is updated
+    when events are added or removed.
+    """
+
+    # over this number of events to read the counts are rebuilt from the store indexes
+    REBUILD_THRESHOLD = 1000
+
+    def __init__(self, events):
+        self.events = events
+        self.time = None
+        self.position = 0
+        self.counts = {}
+        self.events.add_listener(self)
+
+    def detach(self):
+        """
+        stop listening to the event store
+        """
+        self.events.remove_listener(self)
+
+    def _rebuild(self):
+        self.position = self.events.row_at(self.time)
+        self.counts = {}
+        for subject, code in self.events._by_behavior:
+            n = self.events.count_before(subject, code, self.time)
+            if n:
+                self.counts[(subject, code)] = n
+
+    def _update(self, event, delta):
+        key = (event[EVENT_SUBJECT_FIELD_IDX], event[EVENT_BEHAVIOR_FIELD_IDX])
+        n = self.counts.get(key, 0) + delta
+        if n:
+            self.counts[key] = n
+        else:
+            self.counts.pop(key, None)
+
+    def seek(self, time):
+        """
+        move cursor to time
+        """
+        if self.time is None:
+            self.time = time
+            self._rebuild()
+            return
+
+        self.time = time
+        new_position = self.events.row_at(time)
+        if abs(new_position - self.position) > self.REBUILD_THRESHOLD:
+            self._rebuild()
+            return
+
+        if new_position > self.position:
+            for event in self.events[self.position:new_position]:
+                self._update(event, 1)
+        else:
+            for event in self.events[new_position:self.position]:
+                self._update(event, -1)
+        self.position = new_position
+
+    def is_open(self, subject, code):
+        """
+        True if state behavior code is started for subject at cursor time
+        """
+        return self.counts.get((subject, code), 0) % 2 == 1
+
+    def current_states(self, stateBehaviorsCodes, subjects):
+        """
+        return dictionary with list of started state behaviors by subject index
+        subjects: dictionary of subjects (index: {"name": ...})
+        """
+        return {idx: [sbc for sbc in stateBehaviorsCodes if self.is_open(subjects[idx]["name"], sbc)] for idx in subjects}
+
+    def event_inserted(self, row, event):
+        if self.time is not None and event[EVENT_TIME_FIELD_IDX] <= self.time:
+            self.position += 1
+            self._update(event, 1)
+
+    def event_removed(self, row, event):
+        if self.time is not None and event[EVENT_TIME_FIELD_IDX] <= self.time:
+            self.position -= 1
+            self._update(event, -1)
+
+    def events_reset(self):
+        if self.time is not None:
+            self._rebuild()
+
+
+class StoredEvents(object):
+    """
+    base class for the events of an observation kept outside of an event list
+    (not modified until converted to a list by decimal_events)
+    """
+
+    def rows(self):
+        """
+        iterate events as (time (float), subject, code, modifier, comment)
+        """
+        return iter([])
+
+    def __len__(self):
+        return sum(1 for row in self.rows())
+
+    def tolist(self):
+        """
+        events with float time (as read from project file)
+        """
+        return [list(row) for row in self.rows()]
+
+    def decimal_events(self):
+        """
+        events with Decimal time
+        """
+        return [[Decimal(str(row[0]))] + list(row[1:]) for row in self.rows()]
+
+
+class CompactEvents(StoredEvents):
+    """
+    events of an observation stored in columns: times (array of floats) and
+    subject, code, modifier and comment (arrays of indexes in a table of interned strings)
+
+    about 24 bytes by event instead of a list of a Decimal and 4 strings.
+    Events are converted to [Decimal time, subject, code, modifier, comment] lists by decimal_events
+    """
+
+    __slots__ = ("times", "strings", "columns")
+
+    def __init__(self, times, strings, columns):
+        self.times = times
+        self.strings = strings
+        self.columns = columns
+
+    @classmethod
+    def from_events(cls, events):
+        """
+        return CompactEvents from list of events read from project file
+        or None if events can not be stored without loss (time not float, missing field)
+        """
+        if set(map(len, events)) - {len(pj_obs_fields)}:
+            return None
+
+        times = array("d")
+        if set(map(type, map(itemgetter(EVENT_TIME_FIELD_IDX), events))) - {float}:
+            return None
+        times.extend(map(itemgetter(EVENT_TIME_FIELD_IDX), events))
+
+        strings, index, columns = [], {}, []
+        for field_idx in (EVENT_SUBJECT_FIELD_IDX, EVENT_BEHAVIOR_FIELD_IDX, EVENT_MODIFIER_FIELD_IDX, EVENT_COMMENT_FIELD_IDX):
+            values = set(map(itemgetter(field_idx), events))
+            if not all(isinstance(value, str) for value in values):
+                return None
+            for value in values - set(index):
+                index[value] = len(strings)
+                strings.append(sys.intern(value))
+            columns.append(array("I", map(index.__getitem__, map(itemgetter(field_idx), events))))
+
+        return cls(times, strings, columns)
+
+    def __len__(self):
+        return len(self.times)
+
+    def rows(self):
+        """
+        iterate events as (time (float), subject, code, modifier, comment)
+        """
+        strings = self.strings
+        for time, subject, code, modifier, comment in zip(self.times, *self.columns):
+            yield (time, strings[subject], strings[code], strings[modifier], strings[comment])
+
+
+def start_stop_flags(events, stateBehaviorsCodes):
+    """
+    return status (START/STOP or POINT) of each event in one pass
+    a state event is a STOP if the number of previous events (with lower time)
+    with same subject, code and modifier is odd
+    """
+
+    state_codes = set(stateBehaviorsCodes)
+    flags = [POINT] * len(events)
+
+    if isinstance(events, EventStore) or all(events[idx][EVENT_TIME_FIELD_IDX] <= events[idx + 1][EVENT_TIME_FIELD_IDX] for idx in range(len(events) - 1)):
+        order = range(len(events))
+    else:
+        order = sorted(range(len(events)), key=lambda idx: events[idx][EVENT_TIME_FIELD_IDX])
+
+    # (subject, code, modifier): [number of events, time of last event, number of events before time of last event]
+    counters = {}
+    for idx in order:
+        event = events[idx]
+        if event[EVENT_BEHAVIOR_FIELD_IDX] not in state_codes:
+            continue
+        time = event[EVENT_TIME_FIELD_IDX]
+        key = (event[EVENT_SUBJECT_FIELD_IDX], event[EVENT_BEHAVIOR_FIELD_IDX], event[EVENT_MODIFIER_FIELD_IDX])
+        if key not in counters:
+            counters[key] = [0, time, 0]
+        counter = counters[key]
+        if counter[1] != time:
+            counter[1], counter[2] = time, counter[0]
+        flags[idx] = STOP if counter[2] % 2 else START
+        counter[0] += 1
+
+    return flags
+
+
+def annotate_start_stop(events, stateBehaviorsCodes):
+    """
+    return events with status (START/STOP or POINT) added as last field
+    """
+    return [event + [flag] for event, flag in zip(events, start_stop_flags(events, stateBehaviorsCodes))]
+
+
+def observation_events(observation):
+    """
+    return the event store of observation
+    (the events list is converted in EventStore if needed)
+    """
+    events = observation[EVENTS]
+    if not isinstance(events, EventStore):
+        events = EventStore(events)
+        observation[EVENTS] = events
+    return events
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+"""
+BORIS
+Behavioral Observation Research Interactive Software
+Copyright 2012-2017 Olivier Friard
+
+This file is part of BORIS.
+
+  BORIS is free software; you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation; either version 3 of the License, or
+  any later version.
+
+  BORIS is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program; if not see <http://www.gnu.org/licenses/>.
+
+"""
+
+import logging
+import subprocess
+import threading
+from collections import OrderedDict
+
+import utilities
+
+# maximal number of frames decoded and dropped to reach a following frame
+# (a larger jump restarts ffmpeg at the required time)
+MAX_FORWARD_FRAMES = 60
+
+# maximal memory used by the decoded frames kept in memory (bytes)
+CACHE_SIZE = 512 * 1024 * 1024
+
+# seconds of media decoded in advance in the direction of travel
+PREFETCH_SECONDS = 2
+
+
+class FrameDecoder(object):
+    """
+    decode the frames of a media file with a ffmpeg process
+    streaming RGB frames over a pipe
+
+    the process is kept running between two frames: the next frames are read
+    without seeking. ffmpeg is restarted only when the required frame
+    is before the last decoded frame or far after it
+    """
+
+    def __init__(self, ffmpeg_bin, fileName, width, height, fps):
+        self.ffmpeg_bin = ffmpeg_bin
+        self.fileName = fileName
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frame_size = width * height * 3
+        self.process = None
+        self.next_frame = 0    # index of the next frame read from the pipe
+
+    def start(self, frame):
+        """
+        start ffmpeg at frame (first frame is 0)
+        """
+        self.close()
+        # seek between two frames to get the required frame despite rounding
+        start_time = max(0, (frame - 0.5) / float(self.fps))
+        command = [self.ffmpeg_bin, "-loglevel", "quiet", "-ss", "{:.6f}".format(start_time), "-i", self.fileName,
+                   "-an", "-sn", "-vf", "scale={}:{}".format(self.width, self.height),
+                   "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+        logging.debug("ffmpeg decoder command: {}".format(command))
+        self.process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                        bufsize=self.frame_size)
+        self.next_frame = frame
+
+    def key(self, frame):
+        """
+        key of frame in FrameCache
+        the size is part of the key: a frame decoded with another size
+        (by a prefetcher stopped after a change of size) is never used
+        """
+        return (self.fileName, self.width, self.height, frame)
+
+    def _read(self):
+        data = self.process.stdout.read(self.frame_size)
+        if len(data) < self.frame_size:
+            # end of media
+            self.close()
+            return None
+        self.next_frame += 1
+        return data
+
+    def frame(self, frame):
+        """
+        return RGB data (width * height * 3 bytes) of frame (first frame is 0) or None if not available
+        """
+        if self.process is None or not self.next_frame <= frame <= self.next_frame + MAX_FORWARD_FRAMES:
+            self.start(frame)
+
+        while self.next_frame < frame:
+            if self._read() is None:
+                return None
+        return self._read()
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdout.close()
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+
+def frame_decoder(ffmpeg_bin, fileName, fps, frame_resize=0):
+    """
+    return FrameDecoder for media file or None if the size of the video is not available
+    frame_resize: width of the frames (0 for original size)
+    """
+    info = utilities.media_info(ffmpeg_bin, fileName)
+    if info is None or not info["hasVideo"]:
+        return None
+    video = [stream for stream in info["streams"] if stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic")][0]
+    try:
+        width, height = int(video["width"]), int(video["height"])
+    except (KeyError, ValueError):
+        return None
+    # ffmpeg rotates the frames of a video recorded in portrait mode
+    rotation = video.get("tags", {}).get("rotate", 0)
+    for side_data in video.get("side_data_list", []):
+        rotation = side_data.get("rotation", rotation)
+    try:
+        if int(float(rotation)) % 180:
+            width, height = height, width
+    except ValueError:
+        pass
+    if frame_resize:
+        # even dimensions required by most pixel formats
+        width, height = frame_resize, max(2, round(height * frame_resize / width / 2) * 2)
+    return FrameDecoder(ffmpeg_bin, fileName, width, height, fps)
+
+
+def cache_size(cache_dir_max_size):
+    """
+    memory used by the decoded frames for the maximal size of the frame cache directory (in MB, 0 for no limit)
+    """
+    if cache_dir_max_size <= 0:
+        return CACHE_SIZE
+    return min(CACHE_SIZE, cache_dir_max_size * 1024 * 1024)
+
+
+class FrameCache(object):
+    """
+    decoded frames kept in memory {(media file, width, height, frame): RGB data}
+    (frames of a previous size are never returned, see FrameDecoder.key)
+    the least recently used frames are removed when the size of frames exceeds max_size bytes
+    """
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.frames
+
+    def get(self, key):
+        with self.lock:
+            data = self.frames.get(key)
+            if data is not None:
+                self.frames.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self.lock:
+            old = self.frames.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.frames[key] = data
+            self.size += len(data)
+            while self.size > self.max_size and len(self.frames) > 1:
+                self.size -= len(self.frames.popitem(last=False)[1])
+
+    def resize(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            while self.size > self.max_size and len(self.frames) > 1:
+                self.size -= len(self.frames.popitem(last=False)[1])
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.size = 0
+
+
+class FramePrefetcher(threading.Thread):
+    """
+    thread decoding with its own ffmpeg process the frames following
+    (or preceding when stepping backward) the last displayed frame
+    """
+
+    def __init__(self, decoder, cache):
+        threading.Thread.__init__(self, daemon=True)
+        self.decoder = decoder
+        self.cache = cache
+        self.condition = threading.Condition()
+        self.request = None
+        self.stopped = False
+
+    def prefetch(self, frame, direction):
+        """
+        decode frames around frame in direction (1 forward, -1 backward)
+        """
+        with self.condition:
+            self.request = (frame, direction)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def frames(self, frame, direction):
+        """
+        frames to decode in order
+        backward the frames are decoded by blocks of one second from the nearest block
+        (each block is decoded from its first frame without restarting ffmpeg)
+        """
+        fps = max(1, int(round(float(self.decoder.fps))))
+        # the prefetched frames must not evict each other
+        span = max(1, min(PREFETCH_SECONDS * fps, self.cache.max_size // (3 * self.decoder.frame_size)))
+        if direction >= 0:
+            return list(range(frame + 1, frame + 1 + span))
+        frames = []
+        for end in range(frame, max(0, frame - span), -fps):
+            frames.extend(range(max(0, end - fps, frame - span), end))
+        return frames
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.request is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    break
+                request, self.request = self.request, None
+
+            for frame in self.frames(*request):
+                # a new request or stop interrupts the decoding
+                if self.stopped or self.request is not None:
+                    break
+                key = self.decoder.key(frame)
+                if key in self.cache:
+                    continue
+                data = self.decoder.frame(frame)
+                if data is None:
+                    break
+                self.cache.put(key, data)
+
+        self.decoder.close()
+
+
+class MediaFrames(object):
+    """
+    frames of a media file served from the frame cache
+    a missing frame is decoded immediately and the next frames
+    in the direction of travel are decoded in advance by a FramePrefetcher
+    """
+
+    def __init__(self, decoder, cache):
+        self.decoder = decoder
+        self.cache = cache
+        self.last_frame = None
+        self.prefetcher = FramePrefetcher(FrameDecoder(decoder.ffmpeg_bin, decoder.fileName, decoder.width, decoder.height, decoder.fps),
+                                          cache)
+        self.prefetcher.start()
+
+    @property
+    def width(self):
+        return self.decoder.width
+
+    @property
+    def height(self):
+        return self.decoder.height
+
+    def frame(self, frame):
+        """
+        return RGB data of frame (first frame is 0) or None if not available
+        """
+        key = self.decoder.key(frame)
+        data = self.cache.get(key)
+        if data is None:
+            data = self.decoder.frame(frame)
+            if data is not None:
+                self.cache.put(key, data)
+
+        direction = -1 if self.last_frame is not None and frame < self.last_frame else 1
+        self.last_frame = frame
+        self.prefetcher.prefetch(frame, direction)
+        return data
+
+    def close(self):
+        self.prefetcher.stop()
+        self.decoder.close()
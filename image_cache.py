@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+"""
+BORIS
+Behavioral Observation Research Interactive Software
+Copyright 2012-2017 Olivier Friard
+
+This file is part of BORIS.
+
+  BORIS is free software; you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation; either version 3 of the License, or
+  any later version.
+
+  BORIS is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program; if not see <http://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+# file of the index in the frame cache directory (the name must not start with BORIS@)
+MANIFEST = ".boris_frame_cache.json"
+
+# version of the manifest (a manifest of another version is rebuilt)
+MANIFEST_FORMAT = 2
+
+# fields of an indexed group of frames
+SIZE, FRAMES, EXTENSION, CREATED, ACCESSED = 0, 1, 2, 3, 4
+
+# size of cache after eviction (fraction of maximum size)
+LOW_WATER_MARK = 0.8
+
+# seconds between two evictions of the cleaning thread
+CLEANING_INTERVAL = 5
+
+
+def group_name(md5FileName, second):
+    """
+    name of group of frames extracted from one second of media
+    (files are named <group>_<frame>.<extension>, first frame is 1)
+    """
+    return "BORIS@{}-{}".format(md5FileName, second)
+
+
+class ImageCacheIndex(object):
+    """
+    index of the frames extracted by ffmpeg in the frame cache directory
+
+    the frames are indexed by group (one second of media extracted by one ffmpeg call):
+    {group: [size, number of frames, extension, creation time, last access time]}.
+    The index is saved in a manifest in the directory. The directory is listed only
+    when the manifest is missing: membership checks and eviction do not read the directory.
+    The least recently used groups are evicted (see evict)
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.groups = {}
+        self.total_size = 0
+        self.current = None     # group of the last frame read (never evicted)
+        self.modified = False   # access times not saved
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self._load()
+
+    def path(self, fileName):
+        return os.path.join(self.directory, fileName)
+
+    def _load(self):
+        try:
+            with open(self.path(MANIFEST), "r") as f:
+                content = json.load(f)
+            if content.get("format") == MANIFEST_FORMAT:
+                self.groups = content["groups"]
+                self.total_size = sum(record[SIZE] for record in self.groups.values())
+                return
+        except FileNotFoundError:
+            pass
+        except:
+            logging.warning("frame cache index {} can not be read".format(self.path(MANIFEST)))
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        index the frames found in directory
+        """
+        groups = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not entry.name.startswith("BORIS@") or not entry.is_file():
+                continue
+            group, _, frame_file = entry.name.rpartition("_")
+            frame, _, extension = frame_file.partition(".")
+            if not group or not frame.isdigit():
+                continue
+            stat = entry.stat()
+            record = groups.setdefault(group, [0, 0, extension, stat.st_mtime, stat.st_mtime])
+            record[SIZE] += stat.st_size
+            record[FRAMES] = max(record[FRAMES], int(frame))
+            record[CREATED] = min(record[CREATED], stat.st_mtime)
+            record[ACCESSED] = max(record[ACCESSED], stat.st_mtime)
+        with self.lock:
+            self.groups = groups
+            self.total_size = sum(record[SIZE] for record in groups.values())
+            self._save()
+
+    def _save(self):
+        tmpFileName = ""
+        try:
+            fd, tmpFileName = tempfile.mkstemp(dir=self.directory, prefix=MANIFEST + ".", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"format": MANIFEST_FORMAT, "groups": self.groups}, f)
+            os.replace(tmpFileName, self.path(MANIFEST))
+            self.modified = False
+        except:
+            logging.warning("frame cache index {} can not be saved".format(self.path(MANIFEST)))
+            if tmpFileName and os.path.isfile(tmpFileName):
+                os.remove(tmpFileName)
+
+    def save(self):
+        """
+        save the access times modified since the last saving
+        """
+        with self.lock:
+            if self.modified:
+                self._save()
+
+    def __contains__(self, group):
+        with self.lock:
+            return group in self.groups
+
+    def frame_file(self, group, frame, extension):
+        """
+        path of frame file of group or None if not indexed
+        """
+        with self.lock:
+            record = self.groups.get(group)
+            if record is None or record[EXTENSION] != extension or not 1 <= frame <= record[FRAMES]:
+                return None
+        return self.path("{}_{}.{}".format(group, frame, extension))
+
+    def get(self, group, frame, extension):
+        """
+        path of frame file of group or None if not indexed
+        the access time of group and the hit/miss counters are updated
+        """
+        img = self.frame_file(group, frame, extension)
+        with self.lock:
+            if img is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.groups[group][ACCESSED] = time.time()
+                self.current = group
+                self.modified = True
+        return img
+
+    def add(self, group, extension, max_frames):
+        """
+        index the frames of group written by ffmpeg (at most max_frames frames)
+        group becomes the current group
+        """
+        size, frames = 0, 0
+        for frame in range(1, max_frames + 1):
+            try:
+                size += os.path.getsize(self.path("{}_{}.{}".format(group, frame, extension)))
+            except OSError:
+                break
+            frames = frame
+        if not frames:
+            return
+        with self.lock:
+            old = self.groups.pop(group, None)
+            if old is not None:
+                self.total_size -= old[SIZE]
+            now = time.time()
+            self.groups[group] = [size, frames, extension, now, now]
+            self.total_size += size
+            self.current = group
+            self._save()
+
+    def discard(self, group):
+        """
+        remove group from index (files not found)
+        """
+        with self.lock:
+            record = self.groups.pop(group, None)
+            if record is not None:
+                self.total_size -= record[SIZE]
+                self._save()
+
+    def size(self):
+        """
+        total size of indexed frames
+        """
+        return self.total_size
+
+    def stats(self):
+        """
+        counters of the cache
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "groups": len(self.groups), "size": self.total_size}
+
+    def evict(self, max_size, low_water_mark=LOW_WATER_MARK):
+        """
+        if size of cache exceeds max_size delete the least recently used groups
+        until the size is lower than low_water_mark * max_size
+        the group of the frame currently viewed is never deleted
+        """
+        with self.lock:
+            if self.total_size <= max_size:
+                return
+            records = []
+            for group in sorted(self.groups, key=lambda group: self.groups[group][ACCESSED]):
+                if self.total_size <= low_water_mark * max_size:
+                    break
+                if group == self.current:
+                    continue
+                record = self.groups.pop(group)
+                self.total_size -= record[SIZE]
+                self.evictions += 1
+                records.append((group, record))
+            self._save()
+
+        for group, record in records:
+            for frame in range(1, record[FRAMES] + 1):
+                try:
+                    os.remove(self.path("{}_{}.{}".format(group, frame, record[EXTENSION])))
+                except OSError:
+                    pass
+
+    def reset(self):
+        """
+        empty the index (the files were deleted)
+        """
+        with self.lock:
+            self.groups = {}
+            self.total_size = 0
+            self.current = None
+            self._save()
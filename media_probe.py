@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+BORIS
+Behavioral Observation Research Interactive Software
+Copyright 2012-2017 Olivier Friard
+
+This file is part of BORIS.
+
+  BORIS is free software; you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation; either version 3 of the License, or
+  any later version.
+
+  BORIS is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program; if not see <http://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+# maximum number of media files analysed at the same time
+MAX_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+# maximum number of media files in cache
+MAX_ENTRIES = 10000
+
+# version of the cached results (results of a previous version are discarded)
+CACHE_FORMAT = 2
+
+
+class MediaInfoCache(object):
+    """
+    cache of the media analysis results saved in a JSON file
+    results are keyed by path, size and modification time of the media file
+    (a modified file is analysed again)
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.lock = threading.Lock()
+        self.entries = None
+        self.modified = False   # results not written in cache file
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = {}
+            try:
+                with open(self.fileName, "r") as f:
+                    content = json.load(f)
+                if content.get("format") == CACHE_FORMAT:
+                    self.entries = content["entries"]
+            except FileNotFoundError:
+                pass
+            except:
+                logging.warning("media information cache {} can not be read".format(self.fileName))
+
+    def key(self, mediaFile):
+        """
+        key of media file (None if file not found)
+        """
+        try:
+            stat = os.stat(mediaFile)
+        except OSError:
+            return None
+        return "{}|{}|{}".format(os.path.abspath(mediaFile), stat.st_size, stat.st_mtime)
+
+    def get(self, mediaFile):
+        """
+        cached result of media file analysis or None
+        """
+        key = self.key(mediaFile)
+        if key is None:
+            return None
+        with self.lock:
+            self._load()
+            if key not in self.entries:
+                return None
+            nframe, videoTime, videoDuration, fps, hasVideo, hasAudio = self.entries[key]
+            return nframe, videoTime, videoDuration, Decimal(fps), hasVideo, hasAudio
+
+    def set(self, mediaFile, result):
+        """
+        store result of media file analysis (the cache is written by save)
+        """
+        key = self.key(mediaFile)
+        if key is None:
+            return
+        nframe, videoTime, videoDuration, fps, hasVideo, hasAudio = result
+        with self.lock:
+            self._load()
+            self.entries.pop(key, None)
+            # durations are Decimal when analysed from ffmpeg output
+            self.entries[key] = [nframe, float(videoTime), float(videoDuration), str(fps), hasVideo, hasAudio]
+            # remove oldest entries
+            for old_key in list(self.entries)[:max(0, len(self.entries) - MAX_ENTRIES)]:
+                del self.entries[old_key]
+            self.modified = True
+
+    def save(self):
+        """
+        write the cache file if results were stored since the last writing
+        """
+        with self.lock:
+            if not self.modified:
+                return
+            entries = dict(self.entries)
+            self.modified = False
+
+        tmpFileName = ""
+        try:
+            fd, tmpFileName = tempfile.mkstemp(dir=os.path.dirname(self.fileName), prefix=".boris_media_info.", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"format": CACHE_FORMAT, "entries": entries}, f)
+            os.replace(tmpFileName, self.fileName)
+        except:
+            logging.warning("media information cache {} can not be saved: {}".format(self.fileName, sys.exc_info()[1]))
+            if tmpFileName and os.path.isfile(tmpFileName):
+                os.remove(tmpFileName)
+
+
+_cache = MediaInfoCache(os.path.expanduser("~") + os.sep + ".boris_media_info.json")
+
+
+def cache():
+    """
+    cache of media analysis results shared by all BORIS sessions of the user
+    """
+    return _cache
+
+
+def probe_files(analysis, fileNames):
+    """
+    analyse media files with a pool of threads (each analysis runs ffmpeg in a subprocess)
+    analysis: function returning result of analysis of a media file
+    return {fileName: result}
+    """
+    fileNames = list(dict.fromkeys(fileNames))
+    if not fileNames:
+        return {}
+    if len(fileNames) == 1:
+        return {fileNames[0]: analysis(fileNames[0])}
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(fileNames))) as executor:
+        return dict(zip(fileNames, executor.map(analysis, fileNames)))
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+"""
+BORIS
+Behavioral Observation Research Interactive Software
+Copyright 2012-2017 Olivier Friard
+
+This file is part of BORIS.
+
+  BORIS is free software; you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation; either version 3 of the License, or
+  any later version.
+
+  BORIS is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program; if not see <http://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+from types import MappingProxyType
+
+from config import *
+from event_store import StoredEvents, CompactEvents, EventStore
+from project_file import lazy_observations, observation_rows, copy_mode
+from utilities import decimal_default
+
+SQLITE = "sqlite"
+
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+SCHEMA = ["CREATE TABLE IF NOT EXISTS project (key TEXT PRIMARY KEY, value TEXT)",
+          "CREATE TABLE IF NOT EXISTS observations (id TEXT PRIMARY KEY, data TEXT)",
+          "CREATE TABLE IF NOT EXISTS events (observation TEXT, time REAL, subject TEXT, code TEXT, modifier TEXT, comment TEXT)",
+          "CREATE INDEX IF NOT EXISTS events_observation ON events (observation, subject, code)"]
+
+
+def is_project_db(fileName):
+    """
+    True if fileName is a project stored in a SQLite database
+    """
+    with open(fileName, "rb") as f:
+        return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+def connect(fileName):
+    return sqlite3.connect(fileName, timeout=30)
+
+
+class DbEvents(StoredEvents):
+    """
+    events of observation obsId stored in the project database fileName
+    the events are read from the database when needed
+    """
+
+    __slots__ = ("fileName", "obsId")
+
+    def __init__(self, fileName, obsId):
+        self.fileName = fileName
+        self.obsId = obsId
+
+    def rows(self):
+        db = connect(self.fileName)
+        try:
+            for row in db.execute("SELECT time, subject, code, modifier, comment FROM events WHERE observation = ? ORDER BY rowid", (self.obsId,)):
+                yield row
+        finally:
+            db.close()
+
+    def __len__(self):
+        db = connect(self.fileName)
+        try:
+            return db.execute("SELECT count(*) FROM events WHERE observation = ?", (self.obsId,)).fetchone()[0]
+        finally:
+            db.close()
+
+
+def read_project(fileName):
+    """
+    read project from database
+    only project, ethogram, subjects and observations are read: the events are read
+    when the observation is opened or analyzed (see DbEvents and project_file.LazyObservation)
+    """
+    db = connect(fileName)
+    try:
+        pj = {}
+        for key, value in db.execute("SELECT key, value FROM project ORDER BY rowid"):
+            pj[key] = json.loads(value) if value is not None else {}
+
+        pj.setdefault(OBSERVATIONS, {})
+        for obsId, data in db.execute("SELECT id, data FROM observations ORDER BY rowid"):
+            observation = json.loads(data)
+            if EVENTS in observation:
+                observation[EVENTS] = DbEvents(fileName, obsId)
+            pj[OBSERVATIONS][obsId] = observation
+    finally:
+        db.close()
+
+    return lazy_observations(pj)
+
+
+def stored_events(observation):
+    """
+    DbEvents of observation if its events were not accessed since reading else None
+    observation can be an observation of a project snapshot (see project_snapshot)
+    """
+    if isinstance(observation, MappingProxyType):
+        events = observation.get(EVENTS)
+    elif getattr(observation, "raw_events", False):
+        events = dict.get(observation, EVENTS)
+    else:
+        return None
+    return events if isinstance(events, DbEvents) else None
+
+
+def detach_events(pj):
+    """
+    replace the DbEvents of observations by CompactEvents read from the database
+    must be called before the project is written in another format:
+    the database file can then be replaced and DbEvents would not be readable
+    """
+    for obsId in pj[OBSERVATIONS]:
+        observation = pj[OBSERVATIONS][obsId]
+        events = dict.get(observation, EVENTS)
+        if isinstance(events, DbEvents):
+            rows = events.tolist()
+            compact_events = CompactEvents.from_events(rows)
+            dict.__setitem__(observation, EVENTS, compact_events if compact_events is not None else rows)
+
+
+def copy_events(cursor, obsId, events, selectedSubjects, eventTypes):
+    """
+    insert the events of selected subjects and behaviors of DbEvents in the events table
+    of the analysis database (see loadEventsInDB) without reading them in Python
+    eventTypes: {code: type of behavior}
+    """
+    # a database can not be attached during a transaction
+    cursor.connection.commit()
+    cursor.execute("ATTACH DATABASE ? AS project", (events.fileName,))
+    try:
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS selected_subjects (name TEXT PRIMARY KEY)")
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS selected_behaviors (code TEXT PRIMARY KEY, type TEXT)")
+        cursor.execute("DELETE FROM selected_subjects")
+        cursor.execute("DELETE FROM selected_behaviors")
+        cursor.executemany("INSERT INTO selected_subjects (name) VALUES (?)", [(subject,) for subject in selectedSubjects])
+        cursor.executemany("INSERT INTO selected_behaviors (code, type) VALUES (?, ?)", list(eventTypes.items()))
+
+        cursor.execute("""INSERT INTO main.events (observation, subject, code, type, modifiers, occurence, comment)
+                          SELECT ?, e.subject, e.code, b.type, e.modifier, e.time, e.comment
+                          FROM (SELECT CASE WHEN subject = '' THEN ? ELSE subject END AS subject, code, modifier, time, comment, rowid AS r
+                                FROM project.events WHERE observation = ?) AS e
+                          JOIN selected_behaviors AS b ON b.code = e.code
+                          WHERE e.subject IN (SELECT name FROM selected_subjects)
+                          ORDER BY e.r""", (obsId, NO_FOCAL_SUBJECT, events.obsId))
+        cursor.connection.commit()
+    finally:
+        cursor.execute("DETACH DATABASE project")
+
+
+def load_events_in_db(pj, event_type, selectedSubjects, selectedObservations, selectedBehaviors):
+    """
+    populate an in-memory database with events from selectedObservations, selectedSubjects and selectedBehaviors
+    pj can be a project snapshot (see project_snapshot): the database can be built and used in a thread
+    event_type: function returning the type of a behavior code
+
+    events are read in one pass and inserted with executemany
+    occurence is stored as REAL
+    return cursor of database
+    """
+    db = sqlite3.connect(":memory:")
+    db.row_factory = sqlite3.Row
+
+    cursor = db.cursor()
+
+    cursor.execute("CREATE TABLE events (observation TEXT, subject TEXT, code TEXT, type TEXT, modifiers TEXT, occurence REAL, comment TEXT);")
+
+    selectedSubjects, selectedBehaviors = set(selectedSubjects), set(selectedBehaviors)
+
+    # type (STATE/POINT) of selected behaviors
+    eventTypes = {}
+    for behavior in selectedBehaviors:
+        behavior_type = event_type(behavior)
+        if behavior_type is not None:
+            eventTypes[behavior] = STATE if STATE in behavior_type.upper() else POINT
+
+    def selected_events(obsId):
+        # extract time, code, modifier and comment ( time:0, subject:1, code:2, modifier:3, comment:4 )
+        for event in observation_rows(pj[OBSERVATIONS][obsId]):
+            if event[2] in selectedBehaviors:
+                subjectStr = NO_FOCAL_SUBJECT if event[1] == "" else event[1]
+                if subjectStr in selectedSubjects:
+                    yield (obsId, subjectStr, event[2], eventTypes[event[2]], event[3], float(event[0]), event[4])
+
+    for obsId in selectedObservations:
+        # events of a project database not modified are copied by SQLite
+        stored = stored_events(pj[OBSERVATIONS][obsId])
+        if stored is not None:
+            copy_events(cursor, obsId, stored, selectedSubjects, eventTypes)
+        else:
+            cursor.executemany("""INSERT INTO events (observation, subject, code, type, modifiers, occurence, comment) VALUES (?,?,?,?,?,?,?)""",
+                               selected_events(obsId))
+
+    cursor.execute("CREATE INDEX events_subject_code ON events (subject, code, modifiers, observation, occurence);")
+    cursor.execute("CREATE INDEX events_observation ON events (observation, subject, code, occurence);")
+
+    db.commit()
+    return cursor
+
+
+class ProjectDbWriter(object):
+    """
+    write project in a SQLite database
+
+    snapshot (GUI thread) copies the project and the events of the observations
+    modified since the last writing. write (can run in a thread) writes
+    the snapshot in one transaction.
+    A snapshot must not be taken while another one is written
+    """
+
+    def __init__(self):
+        self.fileName = ""
+        # obsId: (events, version) written in fileName
+        self.saved = {}
+
+    def snapshot(self, pj, fileName):
+        """
+        return (fileName, project rows, observation rows, events to write)
+        """
+        if fileName != self.fileName:
+            self.fileName = fileName
+            self.saved = {}
+
+        project_rows = [(key, json.dumps(pj[key], default=decimal_default) if key != OBSERVATIONS else None) for key in pj]
+        observation_rows, jobs = [], []
+        for obsId in pj[OBSERVATIONS]:
+            observation = pj[OBSERVATIONS][obsId]
+            observation_rows.append((obsId, json.dumps({key: (None if key == EVENTS else dict.__getitem__(observation, key)) for key in observation},
+                                                       default=decimal_default)))
+
+            if EVENTS not in observation:
+                continue
+            events = dict.get(observation, EVENTS)
+            if isinstance(events, DbEvents) and events.fileName == fileName and events.obsId == obsId:
+                continue
+            if isinstance(events, EventStore):
+                version = events.version
+            elif isinstance(events, StoredEvents):
+                # stored events are never modified
+                version = 0
+            else:
+                version = None
+            if version is not None and self.saved.get(obsId, (None, None))[0] is events and self.saved[obsId][1] == version:
+                continue
+            # events of EventStore are never modified in place: a copy of the list is enough
+            jobs.append((obsId, events, version, events if isinstance(events, StoredEvents) else list(events)))
+
+        return fileName, project_rows, observation_rows, jobs
+
+    def write(self, snapshot):
+        """
+        write snapshot in database
+        a file that is not a project database is replaced atomically
+        """
+        fileName, project_rows, observation_rows, jobs = snapshot
+
+        # events to write (DbEvents are read before the modification of the database)
+        events_rows = []
+        for obsId, events, version, content in jobs:
+            rows = content.rows() if isinstance(content, StoredEvents) else content
+            events_rows.append((obsId, [(obsId, float(row[0]), row[1], row[2], row[3], row[4]) for row in rows]))
+
+        if os.path.isfile(fileName) and is_project_db(fileName):
+            dbFileName, tmpFileName = fileName, ""
+        else:
+            fd, tmpFileName = tempfile.mkstemp(prefix=".{}.".format(os.path.basename(fileName)), suffix=".tmp",
+                                               dir=os.path.dirname(os.path.abspath(fileName)))
+            os.close(fd)
+            dbFileName = tmpFileName
+
+        try:
+            db = connect(dbFileName)
+            try:
+                with db:
+                    for query in SCHEMA:
+                        db.execute(query)
+                    db.execute("DELETE FROM project")
+                    db.executemany("INSERT INTO project (key, value) VALUES (?, ?)", project_rows)
+                    db.execute("DELETE FROM observations")
+                    db.executemany("INSERT INTO observations (id, data) VALUES (?, ?)", observation_rows)
+                    db.execute("DELETE FROM events WHERE observation NOT IN (SELECT id FROM observations)")
+                    for obsId, rows in events_rows:
+                        db.execute("DELETE FROM events WHERE observation = ?", (obsId,))
+                        db.executemany("INSERT INTO events (observation, time, subject, code, modifier, comment) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            finally:
+                db.close()
+            if tmpFileName:
+                copy_mode(fileName, tmpFileName)
+                os.replace(tmpFileName, fileName)
+        except:
+            if tmpFileName and os.path.isfile(tmpFileName):
+                os.remove(tmpFileName)
+            raise
+
+        for obsId, events, version, content in jobs:
+            # events copied from another database are now read from fileName
+            if isinstance(events, DbEvents):
+                events.fileName, events.obsId = fileName, obsId
+            if version is not None:
+                self.saved[obsId] = (events, version)
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+
+"""
+BORIS
+Behavioral Observation Research Interactive Software
+Copyright 2012-2017 Olivier Friard
+
+This file is part of BORIS.
+
+  BORIS is free software; you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation; either version 3 of the License, or
+  any later version.
+
+  BORIS is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program; if not see <http://www.gnu.org/licenses/>.
+
+"""
+
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from decimal import Decimal
+
+from config import *
+from event_store import StoredEvents, CompactEvents, EventStore, EventStoreListener, observation_events
+from utilities import decimal_default
+
+try:
+    import zstandard
+    FLAG_ZSTD_INSTALLED = True
+except:
+    logging.info("zstandard module not installed: zstd compressed project files not available")
+    FLAG_ZSTD_INSTALLED = False
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+# first bytes of compressed files
+COMPRESSION_MAGIC = {GZIP: b"\x1f\x8b", ZSTD: b"\x28\xb5\x2f\xfd"}
+
+# permissions of new project files
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+class LazyObservation(dict):
+    """
+    observation read from a project file
+
+    the events are kept in StoredEvents (or as read if they can not be compacted)
+    and converted to lists with Decimal time at the first access
+    to the events (observation opened or analyzed).
+    Not converted events are saved unchanged by json.dumps (see decimal_default)
+    """
+
+    raw_events = False
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),), {"raw_events": self.raw_events})
+
+    def materialize(self):
+        """
+        convert times of events to Decimal
+        """
+        if self.raw_events:
+            self.raw_events = False
+            events = dict.get(self, EVENTS, [])
+            if isinstance(events, StoredEvents):
+                dict.__setitem__(self, EVENTS, events.decimal_events())
+            else:
+                for event in events:
+                    event[EVENT_TIME_FIELD_IDX] = Decimal(str(event[EVENT_TIME_FIELD_IDX]))
+
+    def __getitem__(self, key):
+        if key == EVENTS:
+            self.materialize()
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        if key == EVENTS:
+            self.raw_events = False
+        dict.__setitem__(self, key, value)
+
+    def get(self, key, default=None):
+        if key == EVENTS:
+            self.materialize()
+        return dict.get(self, key, default)
+
+    def values(self):
+        self.materialize()
+        return dict.values(self)
+
+    def pop(self, key, *args):
+        if key == EVENTS:
+            self.materialize()
+        return dict.pop(self, key, *args)
+
+    def copy(self):
+        self.materialize()
+        return LazyObservation(self)
+
+
+def lazy_observations(pj):
+    """
+    replace the observations of project by LazyObservation with compacted events
+    the time offsets are converted to Decimal
+    """
+    for obsId in pj[OBSERVATIONS]:
+        observation = LazyObservation(pj[OBSERVATIONS][obsId])
+        observation.raw_events = True
+        events = dict.get(observation, EVENTS)
+        compact_events = CompactEvents.from_events(events) if isinstance(events, list) else None
+        if compact_events is not None:
+            dict.__setitem__(observation, EVENTS, compact_events)
+        if "time offset" in observation:
+            observation["time offset"] = Decimal(str(observation["time offset"]))
+        pj[OBSERVATIONS][obsId] = observation
+    return pj
+
+
+def observation_rows(observation):
+    """
+    iterate events of observation for analysis (time can be float or Decimal)
+    events not yet accessed are read without conversion to Decimal
+    observation can be an observation of a project snapshot (see project_snapshot)
+    """
+    if isinstance(observation, LazyObservation) and observation.raw_events:
+        events = dict.get(observation, EVENTS, [])
+    else:
+        events = observation[EVENTS]
+    if isinstance(events, StoredEvents):
+        return events.rows()
+    return iter(events)
+
+
+def observation_codes(observation):
+    """
+    sets of behaviors and subjects coded in observation (events are not converted to Decimal)
+    """
+    behaviors, subjects = set(), set()
+    for event in observation_rows(observation):
+        behaviors.add(event[EVENT_BEHAVIOR_FIELD_IDX])
+        subjects.add(event[EVENT_SUBJECT_FIELD_IDX])
+    return behaviors, subjects
+
+
+def file_compression(fileName):
+    """
+    compression of project file (GZIP, ZSTD or None) detected from its first bytes
+    """
+    with open(fileName, "rb") as f:
+        magic = f.read(4)
+    for compression in COMPRESSION_MAGIC:
+        if magic.startswith(COMPRESSION_MAGIC[compression]):
+            return compression
+    return None
+
+
+def compression_filters():
+    """
+    file dialog filters for saving compressed project files {filter: compression}
+    """
+    filters = {"Compressed projects file (*.boris)": GZIP}
+    if FLAG_ZSTD_INSTALLED:
+        filters["Compressed projects file - zstd (*.boris)"] = ZSTD
+    return filters
+
+
+def read_project_text(fileName):
+    """
+    return text of project file and its compression
+    compressed project files are detected automatically
+    """
+    compression = file_compression(fileName)
+    if compression is None:
+        with open(fileName, "r") as f:
+            return f.read(), None
+
+    with open(fileName, "rb") as f:
+        content = f.read()
+    if compression == GZIP:
+        content = gzip.decompress(content)
+    if compression == ZSTD:
+        content = zstandard.ZstdDecompressor().decompressobj().decompress(content)
+    return content.decode("utf-8"), compression
+
+
+def read_project(projectFileName):
+    """
+    read project file (plain or compressed JSON)
+    the events of observations are converted to Decimal only when accessed (see LazyObservation)
+    return project and compression of file
+    """
+    text, compression = read_project_text(projectFileName)
+    return lazy_observations(json.loads(text)), compression
+
+
+def copy_mode(fileName, tmpFileName):
+    """
+    set permissions of the temporary file replacing fileName
+    """
+    if os.path.isfile(fileName):
+        shutil.copymode(fileName, tmpFileName)
+    else:
+        os.chmod(tmpFileName, 0o666 & ~_umask)
+
+
+def write_atomic(fileName, content, compression=None):
+    """
+    write content in a temporary file of the same directory, flush it on disk
+    and replace fileName: the file is never left truncated
+    content is compressed if compression is GZIP or ZSTD
+    """
+    if compression == GZIP:
+        content = gzip.compress(content.encode("utf-8"), compresslevel=6)
+    if compression == ZSTD:
+        content = zstandard.ZstdCompressor().compress(content.encode("utf-8"))
+
+    directory = os.path.dirname(os.path.abspath(fileName))
+    fd, tmpFileName = tempfile.mkstemp(prefix=".{}.".format(os.path.basename(fileName)), suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb" if isinstance(content, bytes) else "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        copy_mode(fileName, tmpFileName)
+        os.replace(tmpFileName, fileName)
+    except:
+        if os.path.isfile(tmpFileName):
+            os.remove(tmpFileName)
+        raise
+
+
+class ProjectSerializer(object):
+    """
+    JSON serialization of project keeping the serialized events of each observation
+
+    snapshot (GUI thread) dumps the project without events and copies the
+    events of the modified observations. render (can run in a thread) serializes
+    the copied events and inserts them in the project text.
+    The output is the same as json.dumps(pj, indent=1, separators=(",", ":"), default=decimal_default).
+    A snapshot must not be taken while another one is rendered
+    """
+
+    def __init__(self):
+        # obsId: (events, version, serialized events)
+        self.cache = {}
+
+    def _events_version(self, events):
+        if isinstance(events, EventStore):
+            return events.version
+        if isinstance(events, StoredEvents):
+            # stored events are never modified
+            return 0
+        return None
+
+    def snapshot(self, pj):
+        """
+        return project text with placeholders of events, prefix of placeholders
+        and list of (obsId, events, version, serialized events or events to serialize)
+        """
+        for obsId in list(self.cache):
+            if obsId not in pj[OBSERVATIONS]:
+                del self.cache[obsId]
+
+        prefix = "@@{}@@".format(uuid.uuid4().hex)
+        skeleton = dict(pj)
+        skeleton[OBSERVATIONS] = {}
+        jobs = []
+        for obsId in pj[OBSERVATIONS]:
+            observation = pj[OBSERVATIONS][obsId]
+            skeleton[OBSERVATIONS][obsId] = dict(observation)
+            if EVENTS not in observation:
+                continue
+            # the events are not converted to Decimal
+            events = dict.get(observation, EVENTS)
+            skeleton[OBSERVATIONS][obsId][EVENTS] = "{}{}".format(prefix, len(jobs))
+
+            version = self._events_version(events)
+            if version is not None and obsId in self.cache and self.cache[obsId][0] is events and self.cache[obsId][1] == version:
+                jobs.append((obsId, events, version, self.cache[obsId][2]))
+            else:
+                # events of EventStore are never modified in place: a copy of the list is enough
+                jobs.append((obsId, events, version, events if isinstance(events, StoredEvents) else list(events)))
+
+        return json.dumps(skeleton, indent=1, separators=(",", ":"), default=decimal_default), prefix, jobs
+
+    def render(self, snapshot):
+        """
+        return project text
+        """
+        text, prefix, jobs = snapshot
+
+        # the placeholders ("prefix0", "prefix1", ...) are in order of observations
+        parts = text.split('"' + prefix)
+        out = [parts[0]]
+        for idx, ((obsId, events, version, content), part) in enumerate(zip(jobs, parts[1:])):
+            if isinstance(content, str):
+                serialized = content
+            else:
+                # events are at the 3rd indentation level of the project
+                serialized = json.dumps(content, indent=1, separators=(",", ":"), default=decimal_default).replace("\n", "\n   ")
+                if version is not None:
+                    self.cache[obsId] = (events, version, serialized)
+            out.append(serialized)
+            # remove index and closing quote of placeholder
+            out.append(part[len(str(idx)) + 1:])
+        return "".join(out)
+
+    def dumps(self, pj):
+        """
+        return project text
+        """
+        return self.render(self.snapshot(pj))
+
+
+def journal_file_name(projectFileName):
+    """
+    file name of the events journal of project
+    """
+    return projectFileName + ".journal"
+
+
+class EventJournal(EventStoreListener):
+    """
+    append-only journal of the modifications of the events of the current observation
+    written next to the project file.
+    One JSON record by line: {"observation": obsId, "op": "open" | "add" | "remove" | "reset", ...}
+    Records older than the last save are removed by discard
+    """
+
+    def __init__(self, projectFileName):
+        self.projectFileName = projectFileName
+        self.fileName = journal_file_name(projectFileName)
+        self.file = None
+        self.obsId = None
+        self.observation = None
+        self.events = None
+        # the observation is recorded before its first modification
+        self.observation_recorded = False
+
+    def _write(self, record):
+        if self.file is None:
+            self.file = open(self.fileName, "a")
+            # incomplete last record (crash during writing)
+            if self.file.tell():
+                with open(self.fileName, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        self.file.write("\n")
+        self.file.write(json.dumps(record, separators=(",", ":"), default=decimal_default) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _record(self, record):
+        if not self.observation_recorded:
+            self.observation_recorded = True
+            self._write({"observation": self.obsId, "op": "open",
+                         "data": {key: dict.__getitem__(self.observation, key) for key in self.observation if key != EVENTS}})
+        self._write(dict({"observation": self.obsId}, **record))
+
+    def attach(self, obsId, observation, events):
+        """
+        record the modifications of events of observation obsId
+        """
+        if obsId == self.obsId and events is self.events:
+            return
+        self.detach()
+        self.obsId, self.observation, self.events = obsId, observation, events
+        self.observation_recorded = False
+        events.add_listener(self)
+
+    def detach(self):
+        if self.events is not None:
+            self.events.remove_listener(self)
+        self.obsId, self.observation, self.events = None, None, None
+
+    def close(self):
+        self.detach()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def position(self):
+        """
+        size of the journal (records before position are saved by a project snapshot taken now)
+        """
+        if self.file is not None:
+            return self.file.tell()
+        return os.path.getsize(self.fileName) if os.path.isfile(self.fileName) else 0
+
+    def discard(self, position=None):
+        """
+        remove records before position (all records if None): they are saved in the project file
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        # the observation will be recorded again with the next modification
+        self.observation_recorded = False
+        if not os.path.isfile(self.fileName):
+            return
+        tail = ""
+        if position is not None:
+            with open(self.fileName, "r") as f:
+                f.seek(position)
+                tail = f.read()
+        if tail:
+            self.observation_recorded = True
+            write_atomic(self.fileName, tail)
+        else:
+            os.remove(self.fileName)
+
+    def event_inserted(self, row, event):
+        self._record({"op": "add", "event": event})
+
+    def event_removed(self, row, event):
+        self._record({"op": "remove", "event": event})
+
+    def events_reset(self):
+        self._record({"op": "reset", "events": list(self.events)})
+
+
+def replay_journal(pj, projectFileName):
+    """
+    apply the records of the events journal of project to pj
+    return number of applied records (0 if no journal)
+    incomplete records (crash during writing) are ignored
+    """
+    fileName = journal_file_name(projectFileName)
+    if not os.path.isfile(fileName):
+        return 0
+
+    def decimal_event(event):
+        return [Decimal(str(event[EVENT_TIME_FIELD_IDX]))] + event[1:]
+
+    count = 0
+    with open(fileName, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            obsId = record["observation"]
+
+            if record["op"] == "open":
+                if obsId not in pj[OBSERVATIONS]:
+                    observation = dict(record["data"])
+                    for key in ["time offset", "time offset second player"]:
+                        if key in observation:
+                            observation[key] = Decimal(str(observation[key]))
+                    observation[EVENTS] = []
+                    pj[OBSERVATIONS][obsId] = observation
+                count += 1
+                continue
+
+            if obsId not in pj[OBSERVATIONS]:
+                continue
+            events = observation_events(pj[OBSERVATIONS][obsId])
+            if record["op"] == "add":
+                events.add(decimal_event(record["event"]))
+            elif record["op"] == "remove":
+                row = events.row_of(decimal_event(record["event"]))
+                if row != -1:
+                    events.delete_rows([row])
+            elif record["op"] == "reset":
+                events.reset([decimal_event(event) for event in record["events"]])
+            count += 1
+
+    return count
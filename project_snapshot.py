@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+BORIS
+Behavioral Observation Research Interactive Software
+Copyright 2012-2017 Olivier Friard
+
+This file is part of BORIS.
+
+  BORIS is free software; you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation; either version 3 of the License, or
+  any later version.
+
+  BORIS is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program; if not see <http://www.gnu.org/licenses/>.
+
+"""
+
+from types import MappingProxyType
+
+from config import *
+from event_store import StoredEvents, EventStore
+from project_file import LazyObservation
+
+
+def freeze(value):
+    """
+    read-only copy of value (dict as MappingProxyType, list as tuple)
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(value[key]) for key in value})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class ProjectSnapshots(object):
+    """
+    read-only snapshots of the project for the analyses running in a thread
+
+    a snapshot is a MappingProxyType of the project. The events of an observation
+    are a tuple sharing the events of the EventStore (events are never modified in place)
+    and the tuple is reused by the next snapshots while the store is not modified.
+    StoredEvents are never modified and are shared as they are.
+    Snapshots must be taken in the GUI thread
+    """
+
+    def __init__(self):
+        # obsId: (events, version, frozen events)
+        self.events_cache = {}
+
+    def _events(self, obsId, observation):
+        if isinstance(observation, LazyObservation) and observation.raw_events:
+            events = dict.get(observation, EVENTS)
+            if isinstance(events, StoredEvents):
+                return events
+        events = observation[EVENTS]
+        if isinstance(events, StoredEvents):
+            return events
+        if not isinstance(events, EventStore):
+            return tuple(tuple(event) for event in events)
+
+        cached = self.events_cache.get(obsId)
+        if cached is None or cached[0] is not events or cached[1] != events.version:
+            cached = (events, events.version, tuple(events))
+            self.events_cache[obsId] = cached
+        return cached[2]
+
+    def take(self, pj, observations=None):
+        """
+        return snapshot of project
+        observations: ids of observations in snapshot (all observations if None)
+        """
+        if observations is None:
+            observations = list(pj[OBSERVATIONS].keys())
+
+        for obsId in list(self.events_cache):
+            if obsId not in pj[OBSERVATIONS]:
+                del self.events_cache[obsId]
+
+        frozen_observations = {}
+        for obsId in observations:
+            observation = pj[OBSERVATIONS][obsId]
+            frozen = {key: freeze(dict.__getitem__(observation, key)) for key in observation if key != EVENTS}
+            if EVENTS in observation:
+                frozen[EVENTS] = self._events(obsId, observation)
+            frozen_observations[obsId] = MappingProxyType(frozen)
+
+        snapshot = {key: freeze(pj[key]) for key in pj if key != OBSERVATIONS}
+        snapshot[OBSERVATIONS] = MappingProxyType(frozen_observations)
+        return MappingProxyType(snapshot)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+"""
+BORIS
+Behavioral Observation Research Interactive Software
+Copyright 2012-2017 Olivier Friard
+
+This file is part of BORIS.
+
+  BORIS is free software; you can redistribute it and/or modify
+  it under the terms of the GNU General Public License as published by
+  the Free Software Foundation; either version 3 of the License, or
+  any later version.
+
+  BORIS is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program; if not see <http://www.gnu.org/licenses/>.
+
+"""
+
+import statistics
+
+from config import *
+
+
+def event_groups(cursor):
+    """
+    read the events of the analysis database in one query
+
+    return {(subject, code): [(modifier, rows), ...]} and {(subject, code): rows}
+    rows are (occurence, observation) sorted by observation and occurence,
+    modifiers are in order of first insertion in database
+    """
+    by_modifier, by_behavior, first_rowid = {}, {}, {}
+
+    cursor.execute("SELECT rowid, subject, code, modifiers, occurence, observation FROM events ORDER BY observation, occurence")
+    for rowid, subject, code, modifier, occurence, observation in cursor.fetchall():
+        key = (subject, code, modifier)
+        if key not in by_modifier:
+            by_modifier[key] = []
+        by_modifier[key].append((occurence, observation))
+        if rowid < first_rowid.get(key, rowid + 1):
+            first_rowid[key] = rowid
+        by_behavior.setdefault((subject, code), []).append((occurence, observation))
+
+    modifiers = {}
+    for subject, code, modifier in sorted(first_rowid, key=first_rowid.get):
+        modifiers.setdefault((subject, code), []).append((modifier, by_modifier[(subject, code, modifier)]))
+
+    return modifiers, by_behavior
+
+
+def _mean(values):
+    return round(statistics.mean(values), 3) if len(values) else "NA"
+
+
+def _stdev(values):
+    return round(statistics.stdev(values), 3) if len(values) > 1 else "NA"
+
+
+def point_row(subject, behavior, modifier, rows):
+    """
+    number of events and inter-events durations (events of the same observation)
+    """
+    intervals = [rows[idx][0] - rows[idx - 1][0] for idx in range(1, len(rows)) if rows[idx][1] == rows[idx - 1][1]]
+
+    return {"subject": subject,
+            "behavior": behavior,
+            "modifiers": modifier,
+            "duration": "-",
+            "duration_mean": "-",
+            "duration_stdev": "-",
+            "number": len(rows),
+            "inter_duration_mean": _mean(intervals),
+            "inter_duration_stdev": _stdev(intervals)}
+
+
+def state_row(subject, behavior, modifier, rows, start_time, end_time, clip):
+    """
+    durations and inter-events durations of paired (start, stop) events
+    if clip the events are limited to the [start_time, end_time] interval
+    """
+    durations, intervals = [], []
+    for idx in range(0, len(rows), 2):
+        new_init, new_end = rows[idx][0], rows[idx + 1][0]
+        if clip:
+            if (new_init < start_time and new_end < start_time) or (new_init > end_time and new_end > end_time):
+                continue
+            if new_init < start_time:
+                new_init = float(start_time)
+            if new_end > end_time:
+                new_end = float(end_time)
+        durations.append(new_end - new_init)
+
+    # inter events if same observation
+    for idx in range(1, len(rows) - 1, 2):
+        stop, next_start = rows[idx], rows[idx + 1]
+        if stop[1] == next_start[1] and start_time <= stop[0] <= end_time and start_time <= next_start[0] <= end_time:
+            intervals.append(next_start[0] - stop[0])
+
+    return {"subject": subject,
+            "behavior": behavior,
+            "modifiers": modifier,
+            "duration": round(sum(durations), 3),
+            "duration_mean": _mean(durations),
+            "duration_stdev": _stdev(durations),
+            "number": len(durations),
+            "inter_duration_mean": _mean(intervals),
+            "inter_duration_stdev": _stdev(intervals)}
+
+
+def unpaired_row(subject, behavior, modifier):
+    return {"subject": subject, "behavior": behavior, "modifiers": modifier,
+            "duration": UNPAIRED, "duration_mean": UNPAIRED, "duration_stdev": UNPAIRED,
+            "number": UNPAIRED, "inter_duration_mean": UNPAIRED, "inter_duration_stdev": UNPAIRED}
+
+
+def time_budget(cursor, plot_parameters, event_type, single_observation):
+    """
+    time budget of the selected subjects and behaviors from the analysis database
+
+    all events are read with one query and grouped by (subject, behavior, modifier)
+    event_type: function returning the type of a behavior
+    single_observation: True if the time interval (start time, end time) must be applied to events
+
+    return list of all rows and list of (subject, computed rows)
+    """
+
+    start_time, end_time = plot_parameters["start time"], plot_parameters["end time"]
+    # point events are filtered on REAL values (as SQL BETWEEN on occurence)
+    float_start_time, float_end_time = float(start_time), float(end_time)
+    include_modifiers = plot_parameters["include modifiers"]
+    exclude_behaviors = plot_parameters["exclude behaviors"]
+
+    modifiers, by_behavior = event_groups(cursor)
+
+    out, subjects_rows = [], []
+
+    for subject in plot_parameters["selected subjects"]:
+        out_cat = []
+
+        for behavior in plot_parameters["selected behaviors"]:
+
+            behavior_type = event_type(behavior).upper()
+
+            if include_modifiers:
+
+                distinct_modifiers = modifiers.get((subject, behavior), [])
+
+                if not distinct_modifiers:
+                    if not exclude_behaviors:
+                        out.append({"subject": subject, "behavior": behavior, "modifiers": "-",
+                                    "duration": "-", "duration_mean": "-", "duration_stdev": "-", "number": 0,
+                                    "inter_duration_mean": "-", "inter_duration_stdev": "-"})
+                    continue
+
+                if POINT in behavior_type:
+                    for modifier, rows in distinct_modifiers:
+                        if single_observation:
+                            rows = [row for row in rows if float_start_time <= row[0] <= float_end_time]
+                        out_cat.append(point_row(subject, behavior, modifier, rows))
+
+                if STATE in behavior_type:
+                    for modifier, rows in distinct_modifiers:
+                        if len(rows) % 2:
+                            out.append(unpaired_row(subject, behavior, modifier))
+                        else:
+                            out_cat.append(state_row(subject, behavior, modifier, rows, start_time, end_time, single_observation))
+
+            else:  # no modifiers
+
+                rows = by_behavior.get((subject, behavior), [])
+
+                if POINT in behavior_type:
+
+                    if single_observation:
+                        rows = [row for row in rows if float_start_time <= row[0] <= float_end_time]
+
+                    if not rows:
+                        if not exclude_behaviors:
+                            out.append({"subject": subject, "behavior": behavior, "modifiers": "NA",
+                                        "duration": "-", "duration_mean": "-", "duration_stdev": "-", "number": 0,
+                                        "inter_duration_mean": "-", "inter_duration_stdev": "-"})
+                        continue
+
+                    out_cat.append(point_row(subject, behavior, "NA", rows))
+
+                if STATE in behavior_type:
+
+                    if not rows:
+                        if not exclude_behaviors:  # include behaviors without events
+                            out.append({"subject": subject, "behavior": behavior,
+                                        "modifiers": "NA", "duration": 0, "duration_mean": 0,
+                                        "duration_stdev": "NA", "number": 0, "inter_duration_mean": "-",
+                                        "inter_duration_stdev": "-"})
+                        continue
+
+                    if len(rows) % 2:
+                        out.append(unpaired_row(subject, behavior, "NA"))
+                    else:
+                        out_cat.append(state_row(subject, behavior, "NA", rows, start_time, end_time, single_observation))
+
+        out += out_cat
+        subjects_rows.append((subject, out_cat))
+
+    return out, subjects_rows
@@ -30,14 +30,19 @@ except:
 
 import math
 import re
+import json
+import shutil
 import subprocess
 import urllib.parse
 import sys
 import os
 import logging
 from config import *
+from event_store import StoredEvents
+import media_probe
 import subprocess
 from decimal import *
+from fractions import Fraction
 import math
 import datetime
 import socket
@@ -115,6 +120,8 @@ def extract_frames(ffmpeg_bin, second, currentMedia, fps, imageDir, md5FileName,
 def decimal_default(obj):
     if isinstance(obj, Decimal):
         return float(obj)
+    if isinstance(obj, StoredEvents):
+        return obj.tolist()
     raise TypeError
 
 
@@ -403,7 +410,130 @@ def check_ffmpeg_path():
     return False
 
 
+def ffprobe_path(ffmpeg_bin):
+    """
+    path of ffprobe program installed with ffmpeg (None if not found)
+    """
+    directory, name = os.path.split(ffmpeg_bin)
+    ffprobe_bin = os.path.join(directory, name.replace("ffmpeg", "ffprobe"))
+    if ffprobe_bin == ffmpeg_bin:
+        return None
+    if directory:
+        return ffprobe_bin if os.path.isfile(ffprobe_bin) else None
+    # program in PATH
+    return shutil.which(ffprobe_bin)
+
+
+def frame_rate(rate):
+    """
+    frame rate ("30000/1001") as Fraction (None if not defined)
+    """
+    try:
+        rate = Fraction(rate)
+    except (ValueError, ZeroDivisionError, TypeError):
+        return None
+    return rate if rate > 0 else None
+
+
+def media_info(ffmpeg_bin, fileName):
+    """
+    analyse media file with ffprobe in a single call
+
+    return dictionary (None if ffprobe is not available or file can not be analysed):
+    duration (s), start_time (s), fps (Fraction, 0 if no video), nframe,
+    hasVideo, hasAudio, streams (list of ffprobe streams), format (ffprobe format)
+    """
+    ffprobe_bin = ffprobe_path(ffmpeg_bin)
+    if ffprobe_bin is None:
+        return None
+
+    try:
+        p = subprocess.Popen([ffprobe_bin, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", fileName],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, error = p.communicate()
+        probe = json.loads(out.decode("utf-8"))
+    except:
+        logging.debug("ffprobe error: {}".format(sys.exc_info()[1]))
+        return None
+
+    if "format" not in probe:
+        return None
+
+    streams = probe.get("streams", [])
+    video_streams = [stream for stream in streams if stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic")]
+
+    try:
+        duration = float(probe["format"].get("duration", 0))
+    except ValueError:
+        duration = 0
+    try:
+        start_time = float(probe["format"].get("start_time", 0))
+    except ValueError:
+        start_time = 0
+
+    fps, nframe = 0, 0
+    if video_streams:
+        # average frame rate is exact for constant frame rate and correct for variable frame rate
+        fps = frame_rate(video_streams[0].get("avg_frame_rate")) or frame_rate(video_streams[0].get("r_frame_rate")) or 0
+        try:
+            nframe = int(video_streams[0]["nb_frames"])
+        except (KeyError, ValueError):
+            nframe = int(fps * Fraction(duration))
+
+    return {"duration": duration,
+            "start_time": start_time,
+            "fps": fps,
+            "nframe": nframe,
+            "hasVideo": bool(video_streams),
+            "hasAudio": any(stream.get("codec_type") == "audio" for stream in streams),
+            "streams": streams,
+            "format": probe["format"]}
+
+
 def accurate_media_analysis(ffmpeg_bin, fileName):
+    """
+    analyse frame rate and video duration with ffprobe
+    (ffmpeg output is analysed if ffprobe is not available)
+    results are cached (see media_probe.MediaInfoCache)
+
+    return same values as ffmpeg_media_analysis
+    """
+    result = cached_media_analysis(ffmpeg_bin, fileName)
+    media_probe.cache().save()
+    return result
+
+
+def cached_media_analysis(ffmpeg_bin, fileName):
+    """
+    analyse media file (see accurate_media_analysis)
+    the result is stored in cache but the cache file is not written
+    """
+    result = media_probe.cache().get(fileName)
+    if result is None:
+        info = media_info(ffmpeg_bin, fileName)
+        if info is not None:
+            fps = Decimal(info["fps"].numerator) / Decimal(info["fps"].denominator) if info["fps"] else 0
+            result = (info["nframe"], info["duration"] * 1000, info["duration"], fps, info["hasVideo"], info["hasAudio"])
+        else:
+            result = ffmpeg_media_analysis(ffmpeg_bin, fileName)
+        # duration 0: not a media file or file not found
+        if result[2]:
+            media_probe.cache().set(fileName, result)
+    return result
+
+
+def media_analysis_batch(ffmpeg_bin, fileNames):
+    """
+    analyse media files in parallel (see accurate_media_analysis)
+
+    return {fileName: analysis results}
+    """
+    results = media_probe.probe_files(lambda fileName: cached_media_analysis(ffmpeg_bin, fileName), fileNames)
+    media_probe.cache().save()
+    return results
+
+
+def ffmpeg_media_analysis(ffmpeg_bin, fileName):
     """
     analyse frame rate and video duration with ffmpeg
 